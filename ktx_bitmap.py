@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Bitmap operations shared by the extensions, on whole RGBA buffers at once
+"""
+import base64
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from contextlib import ExitStack
+from io import BytesIO
+from tempfile import TemporaryFile
+
+from PIL import Image, ImageChops, ImageMath
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# (color where white, color elsewhere) per White2Alpha mode. A color is a
+# tuple of channel values, None for the original channel and 'fade' for 255
+# minus the average of red, green and blue. None elsewhere leaves the pixel.
+MODES = {
+    1: ((0, 0, 0, 'fade'), None),
+    2: ((255, 255, 255, 'fade'), None),
+    3: ((None, None, None, 'fade'), None),
+    4: ((None, None, None, 0), (0, 0, 0, 255)),
+    5: ((None, None, None, 0), (255, 255, 255, 255)),
+    6: ((0, 0, 0, 0), None),
+}
+# (transparent, opaque) palette entries for the two-color masks of modes 4 and 5
+PALETTES = {
+    4: ((255, 255, 255, 0), (0, 0, 0, 255)),
+    5: ((255, 255, 255, 0), (255, 255, 255, 255)),
+}
+MIME_TYPES = {'png': 'image/png', 'webp': 'image/webp'}
+STRIP_HEIGHT = 256  # rows per strip in tiled processing
+BASE64_CHUNK = 3 << 20  # a multiple of 3 (and of 4) characters or bytes
+
+
+def white_to_alpha(img, threshold, mode):
+    '''Make the pixels of an RGBA image whose red, green and blue are all at
+    least 255 - threshold transparent, the way White2Alpha mode 1-6 does.
+    Returns the new image, img itself when the mode changes nothing.'''
+    if mode not in MODES:
+        return img
+    if np is None:
+        return white_to_alpha_pil(img, threshold, mode)
+    pixels = np.array(img)
+    white_to_alpha_array(pixels, threshold, mode)
+    return Image.fromarray(pixels)
+
+
+def unchanged(before, after):
+    '''Whether two RGBA images have the same pixels.'''
+    if before is after:
+        return True
+    if np is not None:
+        return np.array_equal(np.asarray(before), np.asarray(after))
+    return before.tobytes() == after.tobytes()
+
+
+def white_to_alpha_array(pixels, threshold, mode):
+    '''white_to_alpha on a (height, width, 4) uint8 array, in place.'''
+    white, other = MODES[mode]
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    limit = 255 - threshold
+    if limit > 255:
+        mask = np.zeros(pixels.shape[:2], dtype=bool)
+    else:
+        mask = np.minimum(np.minimum(red, green), blue) >= max(limit, 0)
+    fade = None
+    if 'fade' in white:
+        total = red.astype(np.uint16)
+        total += green
+        total += blue
+        fade = (255 - total // 3).astype(np.uint8)
+    for channel in range(4):
+        value = white[channel]
+        if value is not None:
+            if other is not None:
+                pixels[..., channel] = np.where(mask, fade if value == 'fade' else value, other[channel])
+            else:
+                np.copyto(pixels[..., channel], fade if value == 'fade' else value, where=mask)
+        elif other is not None:
+            np.copyto(pixels[..., channel], other[channel], where=~mask)
+
+
+def white_to_alpha_pil(img, threshold, mode):
+    '''white_to_alpha with Pillow channel operations, for when NumPy is missing.'''
+    white, other = MODES[mode]
+    limit = 255 - threshold
+    red, green, blue, alpha = img.split()
+    mask = ImageChops.darker(ImageChops.darker(red, green), blue).point(lambda v: 255 if v >= limit else 0)
+    fade = None
+    if 'fade' in white:
+        if hasattr(ImageMath, 'lambda_eval'):
+            fade = ImageMath.lambda_eval(lambda args: 255 - (args['r'] + args['g'] + args['b']) / 3,
+                                         r=red, g=green, b=blue)
+        else:  # Pillow before 10.3
+            fade = ImageMath.eval("255 - (r + g + b) / 3", r=red, g=green, b=blue)
+        fade = fade.convert('L')
+
+    def layer(color):
+        return Image.merge('RGBA', [channel if value is None else fade if value == 'fade'
+                                    else Image.new('L', img.size, value)
+                                    for channel, value in zip((red, green, blue, alpha), color)])
+
+    base = img if other is None else layer(other)
+    return Image.composite(layer(white), base, mask)
+
+
+def decode_base64(text, start, out):
+    '''Decode the base64 in text from start on into the file out, a chunk at
+    a time. Whitespace, as in wrapped data URIs, is skipped.'''
+    rest = ''
+    for offset in range(start, len(text), BASE64_CHUNK):
+        chunk = rest + ''.join(text[offset:offset + BASE64_CHUNK].split())
+        cut = len(chunk) - len(chunk) % 4
+        out.write(base64.b64decode(chunk[:cut]))
+        rest = chunk[cut:]
+    if rest:
+        out.write(base64.b64decode(rest + '=' * (-len(rest) % 4)))
+
+
+def encode_base64(source):
+    '''The contents of the file source as a base64 string.'''
+    parts = []
+    for chunk in iter(lambda: source.read(BASE64_CHUNK), b''):
+        parts.append(base64.b64encode(chunk).decode('ascii'))
+    return ''.join(parts)
+
+
+class PngWriter:
+    '''An RGBA PNG written to a file a strip of rows at a time, or a 1-bit
+    one with a palette of two (red, green, blue, alpha) entries. Rows use
+    the Up filter with NumPy, no filter without.'''
+
+    def __init__(self, out, width, height, level=6, palette=None):
+        self.out = out
+        self.previous = None
+        self.compressor = zlib.compressobj(level)
+        out.write(b'\x89PNG\r\n\x1a\n')
+        if palette is None:
+            self.stride = width * 4
+            self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        else:
+            self.stride = (width + 7) // 8
+            self.chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 3, 0, 0, 0))
+            self.chunk(b'PLTE', bytes(value for color in palette for value in color[:3]))
+            self.chunk(b'tRNS', bytes(color[3] for color in palette))
+
+    def chunk(self, kind, data):
+        self.out.write(struct.pack('>I', len(data)))
+        self.out.write(kind)
+        self.out.write(data)
+        self.out.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+    def write(self, rows):
+        '''Add rows, the bytes of whole rows: RGBA, or packed bits with a
+        palette.'''
+        if np is None:
+            data = b''.join(b'\0' + rows[offset:offset + self.stride]
+                            for offset in range(0, len(rows), self.stride))
+        else:
+            pixels = np.frombuffer(rows, dtype=np.uint8).reshape(-1, self.stride)
+            above = np.empty_like(pixels)
+            above[0] = 0 if self.previous is None else self.previous
+            above[1:] = pixels[:-1]
+            filtered = np.empty((len(pixels), self.stride + 1), dtype=np.uint8)
+            filtered[:, 0] = 2
+            np.subtract(pixels, above, out=filtered[:, 1:])
+            self.previous = pixels[-1].copy()
+            data = filtered.tobytes()
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.chunk(b'IDAT', compressed)
+
+    def close(self):
+        self.chunk(b'IDAT', self.compressor.flush())
+        self.chunk(b'IEND', b'')
+
+
+def white_to_alpha_strips(img, out, threshold, mode, strip_height=STRIP_HEIGHT, level=6, palette=False):
+    '''white_to_alpha on img written to the file out as PNG, strip_height
+    rows at a time, so only the source image is ever held whole. Returns
+    whether any pixel changed. See save for palette.'''
+    width, height = img.size
+    palette = PALETTES.get(mode) if palette else None
+    writer = PngWriter(out, width, height, level, palette)
+    changed = False
+    for top in range(0, height, strip_height):
+        strip = img.crop((0, top, width, min(height, top + strip_height))).convert("RGBA")
+        result = white_to_alpha(strip, threshold, mode)
+        changed = changed or not unchanged(strip, result)
+        if palette is None:
+            writer.write(result.tobytes())
+        else:
+            writer.write(result.getchannel('A').point(lambda v: 255 if v else 0, '1').tobytes())
+    writer.close()
+    return changed
+
+
+def save(img, out, mode, image_format='png', level=6, palette=False):
+    '''Write img, a result of white_to_alpha, to the file out as PNG with zlib
+    level, or as lossless WebP with the effort that level maps to. With
+    palette, the two-color masks of modes 4 and 5 are written as 1-bit PNG.'''
+    if image_format == 'webp':
+        img.save(out, 'webp', lossless=True, method=round(level * 6 / 9))
+    elif palette and mode in PALETTES:
+        mask = img.getchannel('A').point(lambda v: 1 if v else 0)
+        mask.putpalette(bytes(value for color in PALETTES[mode] for value in color[:3]))
+        mask.save(out, 'png', compress_level=level, bits=1,
+                  transparency=bytes(color[3] for color in PALETTES[mode]))
+    else:
+        img.save(out, 'png', compress_level=level)
+
+
+def white_to_alpha_save(source, out, threshold, mode, strip_height=0, image_format='png', level=6, palette=False):
+    '''Write what white_to_alpha makes of the image file source to the file
+    out, see save, strip_height rows at a time when that is set (always
+    PNG). Returns whether any pixel changed, out is only complete when one
+    did.'''
+    if strip_height > 0:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None  # strips are meant for huge scans
+        try:
+            with Image.open(source) as img:
+                return white_to_alpha_strips(img, out, threshold, mode, strip_height, level, palette)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+    img = Image.open(source).convert("RGBA")
+    result = white_to_alpha(img, threshold, mode)
+    if unchanged(img, result):
+        return False
+    save(result, out, mode, image_format, level, palette)
+    return True
+
+
+def process_image(source, threshold, mode, strip_height=0, target=None, image_format='png', level=6, palette=False):
+    '''Run white_to_alpha_save on an image given as a data URI, or as the
+    path of a linked file, which is read through a memory map. The result
+    is written to the file target and target is returned when that is set,
+    its base64 is returned otherwise. None when no pixel changes. Worker
+    processes run this for one image each.'''
+    with ExitStack() as stack:
+        if source.startswith('data:'):
+            start = source.index(',') + 1
+            if strip_height > 0:
+                data = stack.enter_context(TemporaryFile())
+                decode_base64(source, start, data)
+                data.seek(0)
+            else:
+                data = BytesIO(base64.b64decode(source[start:]))
+        else:
+            fhl = stack.enter_context(open(source, 'rb'))
+            data = stack.enter_context(mmap.mmap(fhl.fileno(), 0, access=mmap.ACCESS_READ))
+
+        if target is None:
+            output = stack.enter_context(TemporaryFile() if strip_height > 0 else BytesIO())
+            if not white_to_alpha_save(data, output, threshold, mode, strip_height, image_format, level, palette):
+                return None
+            output.seek(0)
+            return encode_base64(output)
+
+        temp_name = f"{target}.{os.getpid()}.tmp"
+        try:
+            with open(temp_name, 'wb') as output:
+                changed = white_to_alpha_save(data, output, threshold, mode, strip_height,
+                                              image_format, level, palette)
+            if not changed:
+                return None
+            os.replace(temp_name, target)
+        finally:
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+        return target
+
+
+def payload_key(href, *settings):
+    '''Hash of the payload of a data URI and the settings it is processed with.'''
+    digest = hashlib.sha256(repr(settings).encode('utf-8'))
+    for offset in range(href.index(',') + 1, len(href), BASE64_CHUNK):
+        digest.update(href[offset:offset + BASE64_CHUNK].encode('utf-8'))
+    return digest.hexdigest()
+
+
+def file_key(path, *settings):
+    '''Hash of the contents of a file and the settings it is processed with.'''
+    digest = hashlib.sha256(repr(settings).encode('utf-8'))
+    with open(path, 'rb') as fhl:
+        if os.fstat(fhl.fileno()).st_size:
+            with mmap.mmap(fhl.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+    return digest.hexdigest()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Per-user on-disk caches shared by the KTX extensions
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+NAME_CACHE_SIZE = 100000
+RESULT_CACHE_BYTES = 200 * 1024 * 1024
+
+
+def cache_dir():
+    '''Directory for per-user cache files, created on first use.'''
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'ktx')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class NameCache:
+    '''Color name results per palette version, evicting the least recently
+    used entries beyond max_size. SQLite does the locking, so several
+    extension processes can share the file. Any error disables the cache
+    for the rest of the run instead of failing the effect.'''
+
+    def __init__(self, path=None, max_size=NAME_CACHE_SIZE):
+        self.max_size = max_size
+        try:
+            self.db = sqlite3.connect(path or os.path.join(cache_dir(), 'colornames.sqlite'), timeout=10)
+            with self.db:
+                self.db.execute('CREATE TABLE IF NOT EXISTS names ('
+                                'palette TEXT, color TEXT, name TEXT, used INTEGER, '
+                                'PRIMARY KEY (palette, color))')
+                self.db.execute('CREATE INDEX IF NOT EXISTS names_used ON names (used)')
+        except (OSError, sqlite3.Error):
+            self.db = None
+
+    def get_many(self, palette, colors):
+        '''Return {color: name} for the colors that are cached, marking them used.'''
+        if self.db is None or not colors:
+            return {}
+        found = {}
+        try:
+            with self.db:
+                for color in colors:
+                    row = self.db.execute('SELECT name FROM names WHERE palette = ? AND color = ?',
+                                          (palette, color)).fetchone()
+                    if row is not None:
+                        found[color] = row[0]
+                self.db.executemany('UPDATE names SET used = ? WHERE palette = ? AND color = ?',
+                                    [(time.time_ns(), palette, color) for color in found])
+        except sqlite3.Error:
+            self.db = None
+            return {}
+        return found
+
+    def put_many(self, palette, names):
+        '''Store {color: name} and evict the oldest entries over max_size.'''
+        if self.db is None or not names:
+            return
+        try:
+            with self.db:
+                used = time.time_ns()
+                self.db.executemany('INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?)',
+                                    [(palette, color, name, used) for color, name in names.items()])
+                self.db.execute('DELETE FROM names WHERE rowid IN '
+                                '(SELECT rowid FROM names ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                                (self.max_size,))
+        except sqlite3.Error:
+            self.db = None
+
+
+class ResultCache:
+    '''Results stored compressed in one file per key (a content hash) in a
+    directory of the cache, evicting the least recently used files once
+    they take more than max_bytes. Any error disables the cache for the
+    rest of the run instead of failing the effect. Data that does not
+    compress, like PNG, is better stored with compress off.'''
+
+    def __init__(self, name, path=None, max_bytes=RESULT_CACHE_BYTES, compress=True):
+        self.max_bytes = max_bytes
+        self.compress = compress
+        try:
+            self.path = path or os.path.join(cache_dir(), name)
+            os.makedirs(self.path, exist_ok=True)
+        except OSError:
+            self.path = None
+
+    def get(self, key):
+        '''The data stored under key, or None, marking it used.'''
+        if self.path is None:
+            return None
+        file_name = os.path.join(self.path, key)
+        try:
+            with open(file_name, 'rb') as fhl:
+                data = fhl.read()
+            if self.compress:
+                data = zlib.decompress(data)
+            os.utime(file_name)
+        except (OSError, zlib.error):
+            return None
+        return data
+
+    def put(self, key, data):
+        '''Store data under key and evict the oldest files over max_bytes.'''
+        if self.path is None:
+            return
+        temp_name = os.path.join(self.path, f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_name, 'wb') as fhl:
+                fhl.write(zlib.compress(data) if self.compress else data)
+            os.replace(temp_name, os.path.join(self.path, key))
+            self.evict()
+        except OSError:
+            self.path = None
+
+    def evict(self):
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for used, size, path in files)
+        for used, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Memoized color parsing, so every distinct color string is parsed once per run
+"""
+from functools import lru_cache
+
+import inkex
+from inkex import Color
+
+CACHE_SIZE = 4096
+# Paint keywords that inkex.Color turns into black instead of rejecting
+NOT_COLORS = ('none', 'transparent', 'currentcolor')
+
+
+def parse_color(value):
+    '''Packed 0xRRGGBBAA for a color string ("#abc", "#AABBCC", "rgb(...)",
+    a color name, ...), or None if it is not a plain color.'''
+    if value is None:
+        return None
+    value = value.strip()
+    if value[:4].lower() != 'url(':
+        value = value.lower()
+    if value in NOT_COLORS:
+        return None
+    return parse_normalized(value)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_normalized(value):
+    if value is not None and len(value) in (4, 7) and value[0] == '#':
+        if len(value) == 4:
+            value = "#" + value[1] * 2 + value[2] * 2 + value[3] * 2
+        try:
+            return int(value[1:], 16) << 8 | 0xFF
+        except ValueError:
+            pass
+    try:
+        color = Color(value)
+    except (inkex.colors.ColorError, ValueError):
+        return None
+    return color.red << 24 | color.green << 16 | color.blue << 8 | round(color.alpha * 255)
+
+
+def unpack_color(packed):
+    '''(red, green, blue, alpha) of a packed color, alpha from 0.0 to 1.0.'''
+    return (packed >> 24, packed >> 16 & 0xFF, packed >> 8 & 0xFF, (packed & 0xFF) / 255)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def hsl_color(hue, saturation, lightness):
+    '''Hex string of the color with this inkex hue, saturation and lightness.'''
+    col = Color("#ff0000")
+    col.hue = hue
+    col.saturation = saturation
+    col.lightness = lightness
+    return str(col)
@@ -1,14 +1,12 @@
 #!/usr/bin/env python3
 
 import inkex
-import os
-import random
-import string
-from lxml import etree
 from math import sqrt
 from inkex import PathElement, Path, Group, Color
 from inkex import colors
-from tempfile import TemporaryDirectory
+from ktx_inkscape import run_inkscape_in_parallel
+from ktx_fills import FillIndex
+from ktx_pathops import can_combine, combine
 
 def hsl(color):
     r = int(color[1:3]) / 255
@@ -38,82 +36,37 @@ def hsl(color):
 def rgb(color):
     return [int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)]
 
-def run_inkscape_and_replace_svg(svg, action_str):
-    '''Invoke a set of actions in a child Inkscape then replace the current
-    SVG contents with those of the child Inkscape.'''
-
-    with TemporaryDirectory(prefix='inkscape-command-') as tmpdir:
-        svg_file = inkex.command.write_svg(svg, tmpdir, 'input.svg')
-
-        cwd = os.getcwd()
-        os.chdir(os.path.dirname(svg_file))
-
-        args = ['--batch-process']
-        if action_str[0].strip().islower():
-            instance_tag = ''.join(random.choices(string.ascii_letters, k=10))
-            args.append(f'--app-id-tag={instance_tag}')
-        inkex.command.inkscape(svg_file,
-                               *args,
-                               actions=action_str)
-        os.chdir(cwd)
-        for element in svg:
-            svg.remove(element)
-        append_tree = etree.parse(svg_file)
-        for element in append_tree.getroot():
-            svg.append(element)
-
 class KTX_Combine_Same_Colors(inkex.EffectExtension):
     def add_arguments(self, pars):
         pars.add_argument("--group_only", type=inkex.Boolean, default=True, help="Only Group Together.. not boolean combine")
 
     def effect(self):
         svg = self.document.getroot()
-        document = self.svg.xpath('//svg:*', namespaces=inkex.NSS)
         group_only = self.options.group_only
-        matched = []
-
-        if len(svg.selection) == 0:
-            looper = document
-        else:
-            looper = svg.selection
-
-        for element in looper:
-            tag = element.tag.split('}')[-1]
-            if tag in ['svg', 'defs','g']:
-                continue # skip layers, groups and header
-            attr_id = element.get('id', 'no-id')
-#           style = element.style if hasattr(element, 'style') else 'no-style'
-            fill = element.style.get('fill')
-            fill_found = False
-            for f in matched:
-                if f[0] == fill:
-                    fill_found = True
-                    f.append([attr_id,element])
-                    break
-            if not fill_found:
-                matched.append([fill, [attr_id,element]])
+        index = FillIndex(svg, gradients=False)
+        index.fills.pop(None, None)  # images and clones of nothing stay where they are
 
         if group_only:
-            for f in matched:
+            for fill, elements in index.fills.items():
                 group = Group()
-                group.label = f[0]
+                group.label = fill
                 self.svg.add(group)
-                for elem in f[1:]:
-                    group.add(elem[1])
+                for elem in elements:
+                    group.add(elem)
         else:
-            action_chunks = []
-            for f in matched:
-                action_chunks.extend(['select-by-id:' + elem[0] for elem in f[1:]])
+            batches = []
+            for fill, elements in index.fills.items():
+                if can_combine(elements):
+                    combine(elements)
+                    continue
+                action_chunks = []
+                action_chunks.extend(['select-by-id:' + attr_id for attr_id in index.ids(fill)])
                 action_chunks.extend(['object-to-path'])
                 action_chunks.extend(['path-combine'])
                 action_chunks.extend(['select-clear'])
+                batches.append(action_chunks)
 
-            action_chunks.extend(['export-filename:input.svg',
-                                  'export-overwrite',
-                                  'export-do',
-                                  'quit-immediate'])
-            action_str = ';'.join(action_chunks)
-            run_inkscape_and_replace_svg(svg, action_str)
+            run_inkscape_in_parallel(svg, batches)
 
 
 if __name__ == "__main__":
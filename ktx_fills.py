@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Walk the shapes of a document and index their fills, shared by the extensions
+"""
+import inkex
+from ktx_colors import parse_color, unpack_color
+
+SKIP_TAGS = ('svg', 'defs', 'g')
+SVG_PREFIX = f"{{{inkex.NSS['svg']}}}"
+# Walked into, but not shapes themselves
+CONTAINER_TAGS = ('svg', 'g', 'a', 'switch')
+# Everything else (defs, metadata, clipPath, marker, gradients, sodipodi:namedview,
+# ...) is skipped together with its whole subtree
+SHAPE_TAGS = ('path', 'rect', 'circle', 'ellipse', 'line', 'polyline', 'polygon', 'text', 'image', 'use')
+GRADIENT_TAGS = (f"{SVG_PREFIX}linearGradient", f"{SVG_PREFIX}radialGradient")
+
+
+def iter_shapes(root, groups=False):
+    '''Yield the rendered shapes below root in document order, streaming the
+    tree instead of collecting it. Groups are yielded too when groups is set.'''
+    stack = [iter((root,))]
+    while stack:
+        for element in stack[-1]:
+            tag = element.tag
+            if not isinstance(tag, str) or not tag.startswith(SVG_PREFIX):
+                continue
+            tag = tag[len(SVG_PREFIX):]
+            if tag in CONTAINER_TAGS:
+                if groups and tag == 'g':
+                    yield element
+                stack.append(iter(element))
+                break
+            if tag in SHAPE_TAGS:
+                yield element
+        else:
+            stack.pop()
+
+
+def normalize_fill(fill):
+    '''Lower case a fill (but not url ids) and expand "#rgb", so one color
+    written two ways ends up in one entry.'''
+    if fill is None:
+        return None
+    fill = fill.strip()
+    if fill[:4].lower() != 'url(':  # ids are case sensitive
+        fill = fill.lower()
+    if len(fill) == 4 and fill[0] == '#':
+        fill = "#" + fill[1] * 2 + fill[2] * 2 + fill[3] * 2
+    return fill
+
+
+class FillResolver:
+    '''Effective fill of elements: inline style, then stylesheet rules, then
+    the fill attribute, then the parent's fill. Images have no fill and
+    clones have the fill of the element they show. A text that gets no fill
+    this way has the one of its first tspan that does, or black. Each
+    stylesheet rule is matched against the document once, values of parents
+    are remembered for their other children, and gradients are looked up
+    once per id.'''
+
+    def __init__(self, svg, gradients=True):
+        self.svg = svg
+        self.gradients = gradients
+        self.rules = None  # element -> [(specificity, order, style)]
+        self.inherited = {}  # (parent, property) -> value
+        self.paints = {}  # gradient id -> representative color
+
+    def fill(self, element, seen=()):
+        tag = element.tag.split('}')[-1]
+        if tag == 'image':
+            return None
+        if tag == 'use':
+            source = element.href
+            if source is None or source in seen:
+                return None
+            return self.fill(source, seen + (element,))
+        fill = self.value(element, 'fill')
+        if fill is None and tag == 'text':
+            for span in element.iter(f"{SVG_PREFIX}tspan"):
+                fill = self.value(span, 'fill')
+                if fill is not None:
+                    element = span
+                    break
+        if fill == 'currentcolor':
+            fill = self.value(element, 'color')
+        if fill is None:
+            fill = '#000000'  # the initial value
+        if self.gradients and fill.startswith('url('):
+            fill = self.paint(fill)
+        return fill
+
+    def value(self, element, name):
+        value = element.style.get(name)
+        if value is None:
+            value = self.rule_value(element, name)
+        if value is None:
+            value = element.get(name)
+        value = normalize_fill(value)
+        if value is None or value == 'inherit':
+            parent = element.getparent()
+            if parent is None or not isinstance(parent.tag, str):
+                return None
+            key = (parent, name)
+            if key not in self.inherited:
+                self.inherited[key] = self.value(parent, name)
+            value = self.inherited[key]
+        return value
+
+    def rule_value(self, element, name):
+        if self.rules is None:
+            self.rules = {}
+            order = 0
+            for sheet in self.svg.stylesheets:
+                for style in sheet:
+                    for xpath, specificity in zip(style.to_xpaths(), style.get_specificities()):
+                        for match in self.svg.xpath(xpath):
+                            self.rules.setdefault(match, []).append((specificity, order, style))
+                        order += 1
+        value = None
+        for specificity, order, style in sorted(self.rules.get(element, []), key=lambda rule: rule[:2]):
+            value = style.get(name, value)
+        return value
+
+    def paint(self, fill):
+        '''Average stop color of a url(#gradient) fill, following xlink:href
+        to the gradient that holds the stops. Falls back to the color after
+        the url() if there is one, or keeps the fill as it is, e.g. for
+        patterns.'''
+        ref, _, fallback = fill[4:].partition(')')
+        ref = ref.strip('\'" ')
+        if ref not in self.paints:
+            color = None
+            gradient = self.svg.getElementById(ref[1:]) if ref.startswith('#') else None
+            seen = set()
+            stops = []
+            while gradient is not None and gradient.tag in GRADIENT_TAGS and gradient.get('id') not in seen:
+                seen.add(gradient.get('id'))
+                stops = [stop for stop in gradient if stop.tag == f"{SVG_PREFIX}stop"]
+                if stops:
+                    break
+                href = gradient.get('xlink:href') or gradient.get('href') or ''
+                gradient = self.svg.getElementById(href[1:]) if href.startswith('#') else None
+            colors = []
+            for stop in stops:
+                packed = parse_color(stop.style.get('stop-color') or stop.get('stop-color') or 'black')
+                if packed is not None:
+                    colors.append(unpack_color(packed))
+            if colors:
+                color = "#%02x%02x%02x" % (round(sum(c[0] for c in colors) / len(colors)),
+                                            round(sum(c[1] for c in colors) / len(colors)),
+                                            round(sum(c[2] for c in colors) / len(colors)))
+            self.paints[ref] = color
+        if self.paints[ref] is not None:
+            return self.paints[ref]
+        return normalize_fill(fallback) if fallback.strip() else fill
+
+
+class FillIndex:
+    '''Elements of the current selection, or the shapes of the whole document
+    when nothing is selected, in z-order with their effective fill. Built by
+    a single walk that resolves each fill once. With gradients set, gradient fills
+    are replaced by their average stop color. Images are indexed under None.'''
+
+    def __init__(self, svg, use_selection=True, groups=False, gradients=True):
+        self.elements = []  # [element, fill] in document order
+        self.fills = {}  # fill -> elements, in order of first appearance
+        resolver = FillResolver(svg, gradients)
+
+        if use_selection and len(svg.selection) > 0:
+            skip = ('svg', 'defs') if groups else SKIP_TAGS
+            looper = [element for element in svg.selection.rendering_order()
+                      if element.tag.split('}')[-1] not in skip]
+        else:
+            looper = iter_shapes(svg, groups)
+
+        for element in looper:
+            fill = resolver.fill(element)
+            self.elements.append([element, fill])
+            self.fills.setdefault(fill, []).append(element)
+
+    def ids(self, fill):
+        return [element.get('id', 'no-id') for element in self.fills.get(fill, [])]
+
+    def rgba(self, fill):
+        '''(red, green, blue, alpha) of a fill, None when it is not a plain
+        color, e.g. a gradient reference.'''
+        packed = parse_color(fill)
+        return None if packed is None else unpack_color(packed)
@@ -4,6 +4,7 @@ from lxml import etree
 from math import sqrt,floor
 from inkex import PathElement, Path, Group, Color,Rectangle
 from inkex import colors
+from ktx_colors import hsl_color
 
 def draw_Tile(x, y, width, height, radius, col, name, parent):
     elem = parent.add(Rectangle())
@@ -53,10 +54,7 @@ class KTX_HueStrip(inkex.EffectExtension):
         
         for y in range(1):
             for x in range(floor(255/incr)):
-                kleur = Color("#ff0000")
-                kleur.hue = hue
-                kleur.saturation = satu
-                kleur.lightness = valu
+                kleur = hsl_color(hue, satu, valu)
                 if offset_gap:
                     x1 = x * offset_x
                 else:
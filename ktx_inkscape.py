@@ -0,0 +1,582 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Run Inkscape actions on a document through one long lived `inkscape --shell`
+process, or a one-off `inkscape --pipe` that reads the document from stdin and
+writes the result to stdout. Shared by the extensions that merge, combine or
+union shapes.
+
+Batch runs can apply one action list to many files with a single Inkscape:
+
+    python3 ktx_inkscape.py "select-all;object-to-path" a.svg b.svg ...
+"""
+import argparse
+import atexit
+import hashlib
+import os
+import queue
+import random
+import re
+import string
+import sys
+import threading
+import time
+from collections import deque
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import Popen, PIPE, TimeoutExpired
+from tempfile import TemporaryDirectory
+
+import inkex
+from inkex.command import CommandNotFound, ProgramRunError, INKSCAPE_EXECUTABLE_NAME, call, which
+from lxml import etree
+from ktx_cache import ResultCache
+
+TIMEOUT = 300  # seconds for one batch of actions
+START_TIMEOUT = 60  # seconds for Inkscape to come up and answer
+PING_TIMEOUT = 10
+SENTINEL = 'inkscape-version'  # prints one line that marks the end of a batch
+ARG_LIMIT = 7000  # longer action strings go through --actions-file
+LINE_LIMIT = 65536  # characters of actions fed to the shell per line
+TRANSPORT = 'shell'  # or 'pipe'
+REFERENCE = re.compile(r'#([^\s#;,()\'"]+)')  # href="#id", url(#id)
+STAND_IN = 'ktx-cached-'  # prefix of the ids results are cached with
+UNNAMED = 'ktx-unnamed-'  # prefix of the ids elements without one get for a run
+WORKERS = os.cpu_count() or 1  # Inkscapes running at once for independent batches
+
+
+class ShellTimeout(ProgramRunError):
+    '''Inkscape did not answer in time.'''
+
+
+class InkscapeShell:
+    '''An `inkscape --shell` child fed one line of actions at a time. Every
+    line is followed by the version query, whose answer tells that Inkscape
+    is done with it. A child that did not answer in time is killed, and a
+    batch whose child died is retried once in a fresh one.'''
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.process = None
+        self.version = None
+        self.output = None
+        self.errors = deque(maxlen=50)
+
+    def start(self):
+        tag = ''.join(random.choices(string.ascii_letters, k=10))
+        kwargs = {}
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = 0x08000000  # create no console window
+        self.process = Popen([which(INKSCAPE_EXECUTABLE_NAME), '--shell', f'--app-id-tag={tag}'],
+                             stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                             env=dict(os.environ, SELF_CALL='true'), **kwargs)
+        # a queue per child, so output of a killed one never shows up later
+        self.output = queue.Queue()
+        self.errors.clear()
+        threading.Thread(target=self.pump, args=(self.process.stdout, self.output.put), daemon=True).start()
+        threading.Thread(target=self.pump, args=(self.process.stderr, self.errors.append, False), daemon=True).start()
+        self.version = None
+        lines = self.send('', START_TIMEOUT, lambda line: re.match(r'Inkscape \d', line))
+        self.version = lines[-1]
+
+    @staticmethod
+    def pump(stream, put, end=True):
+        with stream:
+            for line in iter(stream.readline, b''):
+                put(line.decode('utf-8', 'replace'))
+        if end:
+            put(None)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def healthy(self):
+        '''Whether the child is running and still answers.'''
+        if not self.alive():
+            return False
+        try:
+            self.send('', PING_TIMEOUT)
+        except ProgramRunError:
+            return False
+        return True
+
+    def send(self, line, timeout, done=None):
+        '''Feed one line of actions and return the output lines up to the
+        version answer. Raises ProgramRunError when the child exits, and
+        ShellTimeout when it does not answer within timeout seconds.'''
+        if done is None:
+            done = lambda text: text == self.version
+        try:
+            self.process.stdin.write(line.encode('utf-8') + b'\n' + SENTINEL.encode('utf-8') + b'\n')
+            self.process.stdin.flush()
+        except OSError:
+            self.stop(kill=True)
+            raise ProgramRunError('Inkscape shell is not running', None)
+        lines = []
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                text = self.output.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                self.stop(kill=True)
+                raise ShellTimeout(f'Inkscape did not answer within {timeout} seconds', None)
+            if text is None:
+                self.stop(kill=True)
+                raise ProgramRunError(INKSCAPE_EXECUTABLE_NAME, -1, ''.join(self.errors), ''.join(lines), line)
+            while text.startswith('> '):  # the shell prompt is not followed by a newline
+                text = text[2:]
+            text = text.rstrip('\r\n')
+            lines.append(text)
+            if done(text):
+                return lines
+
+    def run(self, actions):
+        '''Run a list of actions, starting or restarting the child as needed.
+        Long lists are fed as several lines. Returns the output of the
+        actions.'''
+        lines = chunk_actions(actions, LINE_LIMIT)
+        for attempt in (1, 2):
+            if not self.healthy():
+                self.stop()
+                self.start()
+            try:
+                output = []
+                for line in lines:
+                    output.extend(self.send(line, self.timeout)[:-1])
+                return '\n'.join(output)
+            except ShellTimeout:
+                raise  # would only take as long again
+            except ProgramRunError:
+                if attempt == 2:
+                    raise
+
+    def stop(self, kill=False):
+        '''Quit the child, or kill it right away when it is stuck.'''
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        try:
+            if not kill and process.poll() is None:
+                process.stdin.write(b'quit\n')
+                process.stdin.flush()
+                process.wait(timeout=5)
+        except (OSError, TimeoutExpired):
+            kill = True
+        if kill and process.poll() is None:
+            process.kill()
+            process.wait()
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+
+def compile_actions(actions, limit=LINE_LIMIT):
+    '''Actions with every run of select-by-id merged into one
+    `select-by-id:a,b,c`, split where it would get longer than limit.
+    Empty actions are dropped.'''
+    compiled = []
+    ids = []
+    size = 0
+
+    def flush():
+        if ids:
+            compiled.append('select-by-id:' + ','.join(ids))
+            ids.clear()
+
+    for action in actions:
+        name, _, arg = action.partition(':')
+        if name.strip() != 'select-by-id':
+            flush()
+            if action.strip():
+                compiled.append(action)
+            continue
+        for attr_id in arg.split(','):
+            attr_id = attr_id.strip()
+            if not attr_id:
+                continue
+            if ids and size + len(attr_id) + 1 > limit:
+                flush()
+            if not ids:
+                size = len('select-by-id:') - 1
+            ids.append(attr_id)
+            size += len(attr_id) + 1
+    flush()
+    return compiled
+
+
+def chunk_actions(actions, limit=LINE_LIMIT):
+    '''Join actions into lines of at most limit characters, or one action
+    each when it is longer.'''
+    lines = []
+    line = ''
+    for action in actions:
+        if line and len(line) + 1 + len(action) > limit:
+            lines.append(line)
+            line = ''
+        line = action if not line else line + ';' + action
+    if line or not lines:
+        lines.append(line)
+    return lines
+
+
+_shell = None
+
+
+def shell():
+    '''The Inkscape shell shared by this process, stopped at exit.'''
+    global _shell
+    if _shell is None:
+        _shell = InkscapeShell()
+        atexit.register(_shell.stop)
+    return _shell
+
+
+def shell_actions(svg_file, actions):
+    '''Open svg_file in the shared shell, run the actions on it and save it
+    in place. Paths are absolute, so the working directory is left alone.'''
+    export = ['export-filename:' + svg_file, 'export-overwrite', 'export-do']
+    return shell().run(['file-open:' + svg_file] + compile_actions(actions) + export + ['file-close'])
+
+
+def pipe_actions(document, actions):
+    '''Run the actions on document (SVG bytes) in a one-off `inkscape --pipe`
+    and return the result. The document goes in on stdin and comes back on
+    stdout, nothing is written to disk.'''
+    os.environ['SELF_CALL'] = 'true'
+    instance_tag = ''.join(random.choices(string.ascii_letters, k=10))
+    args = ['--pipe', '--export-filename=-', '--export-type=svg', f'--app-id-tag={instance_tag}']
+    action_str = ';'.join(compile_actions(actions))
+    if len(action_str) <= ARG_LIMIT:
+        return call(INKSCAPE_EXECUTABLE_NAME, *args, actions=action_str, stdin=document, return_binary=True)
+    # too long for a command line on Windows
+    with TemporaryDirectory(prefix='inkscape-actions-') as tmpdir:
+        actions_file = os.path.join(tmpdir, 'actions.txt')
+        with open(actions_file, 'w', encoding='utf-8') as fhl:
+            fhl.write(action_str)
+        return call(INKSCAPE_EXECUTABLE_NAME, *args, actions_file=actions_file, stdin=document, return_binary=True)
+
+
+_results = None
+
+
+def results():
+    '''The cache of Inkscape results shared by this process.'''
+    global _results
+    if _results is None:
+        _results = ResultCache('inkscape')
+    return _results
+
+
+def stand_ins(root):
+    '''Stand-in names for the ids of root, in document order. Extensions give
+    new elements random ids, so documents are cached under these instead.'''
+    return {element.get('id'): f'{STAND_IN}{number}' for number, element in enumerate(root.xpath('//*[@id]'))}
+
+
+def rename_ids(root, names):
+    '''Rename the ids in root, and the references to them, as in names.'''
+    def rename(match):
+        return '#' + names.get(match.group(1), match.group(1))
+
+    for element in root.iter(etree.Element):
+        for key, value in element.attrib.items():
+            if key == 'id':
+                if value in names:
+                    element.attrib[key] = names[value]
+            elif '#' in value:
+                element.attrib[key] = REFERENCE.sub(rename, value)
+
+
+def result_key(root, actions, names):
+    '''Hash of the Inkscape build, the actions and the document root, with
+    ids replaced by their stand-in names. None without Inkscape.'''
+    try:
+        program = which(INKSCAPE_EXECUTABLE_NAME)
+        stat = os.stat(program)
+    except (CommandNotFound, OSError):
+        return None
+
+    def rename(match):
+        return '#' + names.get(match.group(1), match.group(1))
+
+    digest = hashlib.sha256(f'{program}\0{stat.st_size}\0{stat.st_mtime_ns}\0'.encode('utf-8'))
+    for action in compile_actions(actions):
+        name, _, arg = action.partition(':')
+        if name.strip() == 'select-by-id':
+            action = 'select-by-id:' + ','.join(names.get(attr_id, attr_id) for attr_id in arg.split(','))
+        digest.update(action.encode('utf-8') + b'\0')
+    for element in root.iter():
+        tag = element.tag
+        if not isinstance(tag, str):  # comments and processing instructions have their factory
+            tag = f'{tag.__name__} {getattr(element, "target", "")}'
+        digest.update(f'\1{tag}\0{element.text}\0{element.tail}\0'.encode('utf-8'))
+        for key, value in element.attrib.items():
+            if key == 'id':
+                value = names.get(value, value)
+            elif '#' in value:
+                value = REFERENCE.sub(rename, value)
+            digest.update(f'{key}\0{value}\0'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def run_cached(root, actions, transport=TRANSPORT):
+    '''Root of the result of running the actions on the document root. A
+    document and actions that were run before, up to the ids, are replayed
+    from the result cache without starting Inkscape.'''
+    names = stand_ins(root)
+    key = result_key(root, actions, names)
+    data = results().get(key) if key else None
+    if data is not None:
+        result = inkex.load_svg(data).getroot()
+        back = {name: attr_id for attr_id, name in names.items()}
+        for element in result.xpath('//*[@id]'):
+            attr_id = element.get('id')
+            if attr_id not in back and attr_id in names:  # new in the result, but taken here
+                number = 1
+                while f'{attr_id}-{number}' in names:
+                    number += 1
+                back[attr_id] = f'{attr_id}-{number}'
+        rename_ids(result, back)
+        return result
+
+    data = run_document(etree.tostring(root.getroottree()), actions, transport)
+    result = inkex.load_svg(data).getroot()
+    if key:
+        cached = deepcopy(result)
+        rename_ids(cached, names)
+        results().put(key, etree.tostring(cached))
+    return result
+
+
+def run_document(document, actions, transport=TRANSPORT):
+    '''Run the actions on document (SVG bytes) and return the result. The
+    "shell" transport hands the document to the shared shell in a temporary
+    file and falls back to "pipe" when the shell cannot be started. Errors
+    of the actions themselves are raised.'''
+    if transport == 'shell':
+        try:
+            with TemporaryDirectory(prefix='inkscape-command-') as tmpdir:
+                svg_file = os.path.join(tmpdir, 'input.svg')
+                with open(svg_file, 'wb') as fhl:
+                    fhl.write(document)
+                shell_actions(svg_file, actions)
+                with open(svg_file, 'rb') as fhl:
+                    return fhl.read()
+        except (CommandNotFound, OSError):
+            pass
+        except ProgramRunError:
+            shell().stop(kill=True)
+            if shell().version is not None:  # it came up, so the actions failed
+                raise
+    return pipe_actions(document, actions)
+
+
+def touched_ids(actions):
+    '''Ids of the elements the actions work on, or None when an action selects
+    elements in some other way than by id.'''
+    ids = set()
+    for action in actions:
+        name, _, arg = action.partition(':')
+        name = name.strip()
+        if name == 'select-by-id':
+            ids.update(attr_id.strip() for attr_id in arg.split(','))
+        elif name.startswith('select') and name != 'select-clear':
+            return None
+    return ids
+
+
+def name_unnamed(svg):
+    '''Give the elements below svg that have no id a temporary one. Inkscape
+    names such elements, which would otherwise come back from a run as new
+    ones.'''
+    number = 0
+    for element in svg.iterdescendants(etree.Element):
+        if element.get('id') is None:
+            element.attrib['id'] = f'{UNNAMED}{number}'
+            number += 1
+
+
+def drop_unnamed(svg):
+    '''Take the ids of name_unnamed off again.'''
+    for element in svg.iterdescendants(etree.Element):
+        if element.get('id', '').startswith(UNNAMED):
+            del element.attrib['id']
+
+
+def added_ids(current, root):
+    '''Ids in root (a result document) that are not in current.'''
+    return {element.get('id') for element in root.iterdescendants(etree.Element)
+            if element.get('id') is not None and element.get('id') not in current}
+
+
+def placement(current, root, touched):
+    '''Where the elements of root (a result document) that have a touched id,
+    or an id that is not in current yet, go: [(element, parent, element to
+    insert after)]. current maps the ids of the document to its elements,
+    which should all have one, see name_unnamed. None when an element has
+    no place to go.'''
+    changed = [element for element in root.iterdescendants(etree.Element)
+               if element.get('id') is not None
+               and (element.get('id') in touched or element.get('id') not in current)]
+    moving = set(changed)
+    steps = []
+    for element in changed:
+        if any(ancestor in moving for ancestor in element.iterancestors()):
+            continue  # comes along with its ancestor
+        parent = element.getparent()
+        if parent is root:
+            target = None
+        elif parent.get('id') in current:
+            target = current[parent.get('id')]
+        else:
+            return None
+        anchor = element.getprevious()
+        while anchor is not None and anchor not in moving and anchor.get('id') not in current:
+            anchor = anchor.getprevious()
+        if anchor is not None and anchor not in moving:
+            anchor = current[anchor.get('id')]
+        steps.append((element, target, anchor))
+    return steps
+
+
+def apply_steps(svg, current, steps, touched):
+    '''Insert the elements of steps (see placement), then drop the touched
+    elements of current. Inserting first keeps the touched elements in place
+    as anchors.'''
+    for element, target, anchor in steps:
+        if anchor is not None:
+            anchor.addnext(element)
+        else:
+            (svg if target is None else target).insert(0, element)
+    for attr_id in touched:
+        if attr_id in current and current[attr_id].getparent() is not None:
+            current[attr_id].getparent().remove(current[attr_id])
+
+
+def merge_back(svg, root, touched):
+    '''Move the elements of root (the result document) that have a touched id,
+    or an id svg does not have yet, into svg in their new place, and drop the
+    touched elements that no longer exist. Everything else in svg is left as
+    it is. Returns False, without changing svg, when an element has no place
+    to go.'''
+    current = {element.get('id'): element for element in svg.xpath('//*[@id]')}
+    steps = placement(current, root, touched)
+    if steps is None:
+        return False
+    apply_steps(svg, current, steps, touched)
+    return True
+
+
+def run_inkscape_and_replace_svg(svg, actions, transport=TRANSPORT):
+    '''Invoke a list of actions in a child Inkscape then bring the changes
+    back into the current SVG. Only the elements the actions selected by id,
+    and the ones Inkscape created, are swapped in. The whole contents are
+    replaced when the actions select some other way.'''
+    name_unnamed(svg)
+    try:
+        root = run_cached(svg, actions, transport)
+        touched = touched_ids(actions)
+        if touched is None or not merge_back(svg, root, touched):
+            del svg[:]
+            svg.extend(list(root))
+    finally:
+        drop_unnamed(svg)
+
+
+def shards(batches, count):
+    '''Split batches into at most count runs of neighbouring batches with
+    about as many selected elements each.'''
+    sizes = [max(1, len(touched_ids(batch))) for batch in batches]
+    share = sum(sizes) / count
+    result = [[]]
+    total = 0
+    for batch, size in zip(batches, sizes):
+        if result[-1] and total >= share * len(result) and len(result) < count:
+            result.append([])
+        result[-1].append(batch)
+        total += size
+    return result
+
+
+def sub_document(document, others):
+    '''Root of document (SVG bytes) with the elements of the ids in others
+    replaced by empty groups, so a shard only carries its own shapes but
+    still knows where the others are.'''
+    root = etree.fromstring(document, parser=etree.XMLParser(huge_tree=True))
+    for element in root.xpath('//*[@id]'):
+        if element.get('id') in others and element.getparent() is not None:
+            placeholder = etree.Element(f"{{{inkex.NSS['svg']}}}g", id=element.get('id'))
+            placeholder.tail = element.tail
+            element.getparent().replace(element, placeholder)
+    return root
+
+
+def run_inkscape_in_parallel(svg, batches, workers=WORKERS):
+    '''Run independent batches of actions (lists that each select their own
+    elements by id, e.g. one per color) in up to workers Inkscapes at once.
+    Each works on a copy of the document without the shapes of the others,
+    and the results are stitched back in place, in z-order.'''
+    batches = [batch for batch in batches if batch]
+    touched = [touched_ids(batch) for batch in batches]
+    parts = shards(batches, workers) if None not in touched else [batches]
+    if len(parts) < 2:
+        if batches:
+            run_inkscape_and_replace_svg(svg, [action for batch in batches for action in batch])
+        return
+    name_unnamed(svg)
+    try:
+        merged = run_shards(svg, parts, set().union(*touched))
+    finally:
+        drop_unnamed(svg)
+    if not merged:  # fall back to one Inkscape for the whole document
+        run_inkscape_and_replace_svg(svg, [action for batch in batches for action in batch])
+
+
+def run_shards(svg, parts, everything):
+    '''The parallel runs of run_inkscape_in_parallel, for parts that touch
+    everything between them. Returns False, without changing svg, when a
+    result has no place to go or two results add the same id.'''
+    document = etree.tostring(svg.getroottree())
+    jobs = []
+    for part in parts:
+        actions = [action for batch in part for action in batch]
+        ids = touched_ids(actions)
+        jobs.append((sub_document(document, everything - ids), actions, ids))
+
+    def work(job):
+        return run_cached(job[0], job[1], 'pipe')
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        roots = list(pool.map(work, jobs))
+
+    current = {element.get('id'): element for element in svg.xpath('//*[@id]')}
+    plans = [placement(current, root, ids) for root, (_, _, ids) in zip(roots, jobs)]
+    if None in plans:
+        return False
+    added = set()
+    for root in roots:
+        ids = added_ids(current, root)
+        if ids & added:
+            return False
+        added |= ids
+    for steps in plans:
+        apply_steps(svg, current, steps, [])
+    for attr_id in everything:
+        if attr_id in current and current[attr_id].getparent() is not None:
+            current[attr_id].getparent().remove(current[attr_id])
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Inkscape actions on SVG files with one Inkscape")
+    parser.add_argument("actions", help="Actions separated by ';'")
+    parser.add_argument("files", nargs="+", help="SVG files, changed in place")
+    args = parser.parse_args()
+    for svg_file in args.files:
+        output = shell_actions(os.path.abspath(svg_file), [a for a in args.actions.split(';') if a.strip()])
+        if output:
+            print(output)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Name That Color: find the nearest named color for a hex value
+
+Palettes are CSV files (hex,name) or JSON lists of [hex, name] pairs in
+ktx_palettes, or any other path. Run this module as a script to compile
+them into binary indexes, and with --lut to also precompute the answer for
+every 24-bit color, which NTC then memory-maps instead of searching.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from ktx_cache import cache_dir
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PALETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ktx_palettes')
+DEFAULT_PALETTE = 'ntc'
+PALETTE_MAGIC = b'KTXPAL01'
+PALETTE_HEADER = struct.Struct('<8s20sI')  # magic, source file digest, palette size
+PALETTE_ENTRY = struct.Struct('<3B3h')  # r, g, b, h, s, l (h may be negative)
+LUT_MAGIC = b'KTXNTC01'
+LUT_HEADER = struct.Struct('<8s20sI')  # magic, palette digest, palette size
+LUT_EXACT = 0x8000
+
+# Weights of the (r, g, b, h, s, l) axes, ndf1 + ndf2 * 2 in the original scan
+WEIGHTS = (1, 1, 1, 2, 2, 2)
+LEAF_SIZE = 8
+# Palette distances computed per NumPy batch in name_many (queries x palette)
+BATCH_CELLS = 1 << 22
+
+
+class NTC:
+    def __init__(self, palette=DEFAULT_PALETTE, cache=None, use_lut=True):
+        self.source = palette_source(palette)
+        self.names = load_palette(self.source)
+        self.memo = {}
+        self.tree = None
+        self.matrix = None
+        self.cache = cache
+        self.lut = None
+        if use_lut:
+            try:
+                self.lut = open_lut(palette_file(self.source, '.lut'), self.digest())
+            except OSError:  # no cache folder
+                pass
+
+    def init(self):
+        self.exact = {}
+        points = []
+        for i in range(len(self.names)):
+            color_hex = "#" + self.names[i][0]
+            if len(self.names[i]) == 2:
+                rgb = self.rgb(color_hex)
+                hsl = self.hsl(color_hex)
+                self.names[i].extend([rgb[0], rgb[1], rgb[2], hsl[0], hsl[1], hsl[2]])
+            self.exact.setdefault(color_hex, i)
+            points.append(tuple(self.names[i][2:8]))
+        self.tree = KDTree(points, WEIGHTS)
+
+    @staticmethod
+    def normalize(color):
+        '''Return color as "#RRGGBB", or None if its length is invalid.'''
+        color = color.upper()
+        if len(color) < 3 or len(color) > 7:
+            return None
+        if len(color) % 3 == 0:
+            color = "#" + color
+        if len(color) == 4:
+            color = "#" + color[1] * 2 + color[2] * 2 + color[3] * 2
+        return color
+
+    def name(self, color):
+        normalized = self.normalize(color)
+        if normalized is None:
+            return ["#000000", "Invalid Color: " + color.upper(), False]
+        color = normalized
+
+        if color in self.memo:
+            return self.memo[color]
+
+        if self.lut is not None:
+            value = struct.unpack_from('<H', self.lut, LUT_HEADER.size + 2 * int(color[1:7], 16))[0]
+            result = self.names[value & ~LUT_EXACT][1]
+            if value & LUT_EXACT:
+                result += " (exact)"
+        else:
+            result = self.label(color, *self.nearest(color))
+        self.memo[color] = result
+        return result
+
+    def name_many(self, colors):
+        '''Name a list of colors, searching the palette once for all unique
+        colors that have not been named before or found in the cache.'''
+        if self.lut is None:
+            pending = set()
+            for color in colors:
+                normalized = self.normalize(color)
+                if normalized is not None and normalized not in self.memo:
+                    pending.add(normalized)
+            pending = sorted(pending)
+            if self.cache is not None:
+                palette = self.digest().hex()
+                cached = self.cache.get_many(palette, pending)
+                self.memo.update(cached)
+                pending = [color for color in pending if color not in cached]
+            found = {}
+            for color, nearest in zip(pending, self.nearest_many(pending)):
+                found[color] = self.label(color, *nearest)
+            self.memo.update(found)
+            if self.cache is not None:
+                self.cache.put_many(palette, found)
+        return [self.name(color) for color in colors]
+
+    def label(self, color, cl, exact):
+        if cl < 0:
+            return color
+        return self.names[cl][1] + (" (exact)" if exact else "")
+
+    def nearest(self, color):
+        '''Return the palette index for a "#RRGGBB" color and whether it is exact.'''
+        if self.tree is None:
+            self.init()
+        if color in self.exact:
+            return self.exact[color], True
+        return self.tree.nearest(tuple(self.rgb(color) + self.hsl(color))), False
+
+    def nearest_many(self, colors):
+        '''nearest() for a list of "#RRGGBB" colors as a single NumPy matrix
+        product, falling back to the k-d tree without NumPy.'''
+        if np is None or not self.names:
+            return [self.nearest(color) for color in colors]
+        if self.tree is None:
+            self.init()
+        if self.matrix is None:
+            # sum(w * (q - p)**2) = sum(w * q**2) - 2 * sum(w * q * p) + sum(w * p**2), and
+            # the first term is the same for the whole row. All terms are integers
+            # far below 2**53, so float64 keeps them exact and ties resolve to
+            # the lowest index like the linear scan.
+            points = np.array([n[2:8] for n in self.names], dtype=np.float64)
+            weights = np.array(WEIGHTS, dtype=np.float64)
+            self.matrix = (-2 * (points * weights).T, (points * points * weights).sum(axis=1))
+        product, norms = self.matrix
+
+        results = [None] * len(colors)
+        queries = []
+        for i, color in enumerate(colors):
+            if color in self.exact:
+                results[i] = (self.exact[color], True)
+            else:
+                queries.append(i)
+        batch = max(1, BATCH_CELLS // len(self.names))
+        for start in range(0, len(queries), batch):
+            chunk = queries[start:start + batch]
+            q = np.array([self.rgb(colors[i]) + self.hsl(colors[i]) for i in chunk], dtype=np.float64)
+            best = (q @ product + norms).argmin(axis=1)
+            for i, cl in zip(chunk, best.tolist()):
+                results[i] = (cl, False)
+        return results
+
+    def digest(self):
+        '''Fingerprint of the palette, stored in the lookup table it was built from.'''
+        return hashlib.sha1(repr([n[:2] for n in self.names]).encode('utf-8')).digest()
+
+    @staticmethod
+    def hsl(color):
+        r = int(color[1:3], 16) / 255
+        g = int(color[3:5], 16) / 255
+        b = int(color[5:7], 16) / 255
+
+        min_val = min(r, g, b)
+        max_val = max(r, g, b)
+        delta = max_val - min_val
+        l = (min_val + max_val) / 2
+
+        s = 0
+        if 0 < l < 1:
+            s = delta / (2 * l if l < 0.5 else (2 - 2 * l))
+
+        h = 0
+        if delta > 0:
+            if max_val == r and max_val != g:
+                h += (g - b) / delta
+            if max_val == g and max_val != b:
+                h += (2 + (b - r) / delta)
+            if max_val == b and max_val != r:
+                h += (4 + (r - g) / delta)
+            h /= 6
+        
+        return [int(h * 255), int(s * 255), int(l * 255)]
+
+    @staticmethod
+    def rgb(color):
+        return [int(color[1:3], 16), int(color[3:5], 16), int(color[5:7], 16)]
+
+
+class KDTree:
+    '''Exact nearest-neighbour search over the NTC (r, g, b, h, s, l) distance.
+
+    Ties are broken on the lowest point index, so the answer is the same as
+    a linear scan that only replaces its best match on a strictly smaller
+    distance.'''
+
+    def __init__(self, points, weights):
+        self.points = points
+        self.weights = weights
+        self.root = self.build(list(range(len(points))))
+
+    def build(self, indices):
+        if len(indices) <= LEAF_SIZE:
+            return (None, None, indices, None)
+        # split on the axis with the largest weighted spread
+        spreads = []
+        for axis, weight in enumerate(self.weights):
+            values = [self.points[i][axis] for i in indices]
+            spreads.append(weight * (max(values) - min(values)) ** 2)
+        axis = spreads.index(max(spreads))
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+        split = self.points[indices[mid]][axis]
+        return (axis, split, self.build(indices[:mid]), self.build(indices[mid:]))
+
+    def nearest(self, query):
+        '''Return the index of the point closest to query, or -1 if empty.'''
+        best = [-1, -1]  # distance, index
+        self.search(self.root, query, best)
+        return best[1]
+
+    def search(self, node, query, best):
+        axis, split, low, high = node
+        if axis is None:
+            r, g, b, h, s, l = query
+            for i in low:
+                pr, pg, pb, ph, ps, pl = self.points[i]
+                ndf = (r - pr)**2 + (g - pg)**2 + (b - pb)**2 + ((h - ph)**2 + (s - ps)**2 + (l - pl)**2) * 2
+                if best[0] < 0 or ndf < best[0] or (ndf == best[0] and i < best[1]):
+                    best[0] = ndf
+                    best[1] = i
+            return
+        diff = query[axis] - split
+        near, far = (low, high) if diff < 0 else (high, low)
+        self.search(near, query, best)
+        # points on the far side are at least this far away along the split axis
+        if best[0] < 0 or self.weights[axis] * diff * diff <= best[0]:
+            self.search(far, query, best)
+
+
+def palette_source(palette):
+    '''Resolve a palette name from ktx_palettes, or a path, to its CSV/JSON file.'''
+    if os.path.isfile(palette):
+        return palette
+    for ext in ('.csv', '.json'):
+        source = os.path.join(PALETTE_DIR, palette + ext)
+        if os.path.isfile(source):
+            return source
+    raise FileNotFoundError(f"Palette not found: {palette}")
+
+
+def palette_file(source, ext):
+    '''Path of a file compiled from a palette source: next to the palettes
+    that ship with the extensions, in the user's cache for any other file,
+    so nothing is left in the folder of a custom palette.'''
+    source = os.path.abspath(source)
+    if os.path.dirname(source) == PALETTE_DIR:
+        return os.path.splitext(source)[0] + ext
+    name = os.path.splitext(os.path.basename(source))[0]
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir(), 'palettes', f"{name}-{digest}{ext}")
+
+
+def read_palette(source):
+    '''Parse a palette source into [hex, name] rows with hex as "RRGGBB".'''
+    if source.lower().endswith('.json'):
+        with open(source, encoding='utf-8') as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.items()
+    else:
+        with open(source, newline='', encoding='utf-8') as f:
+            entries = [row for row in csv.reader(f) if row and row[0].strip().lower() != 'hex']
+    names = []
+    for entry in entries:
+        hex_value, name = entry[0].strip(), " ".join(str(entry[1]).splitlines())
+        normalized = NTC.normalize(hex_value)
+        if normalized is None or len(normalized) != 7:
+            raise ValueError(f"Invalid color in palette {source}: {hex_value}")
+        names.append([normalized[1:], name])
+    return names
+
+
+def load_palette(source):
+    '''Load a palette from its compiled index, (re)compiling it from the
+    source when the index is missing or stale.'''
+    with open(source, 'rb') as f:
+        source_digest = hashlib.sha1(f.read()).digest()
+    try:
+        with open(palette_file(source, '.ktxpal'), 'rb') as f:
+            data = f.read()
+        magic, digest, count = PALETTE_HEADER.unpack_from(data)
+        if (magic, digest) == (PALETTE_MAGIC, source_digest):
+            offset = PALETTE_HEADER.size + count * PALETTE_ENTRY.size
+            labels = data[offset:].decode('utf-8').split('\n') if count else []
+            names = []
+            for i, (r, g, b, h, s, l) in enumerate(PALETTE_ENTRY.iter_unpack(data[PALETTE_HEADER.size:offset])):
+                names.append(["%02X%02X%02X" % (r, g, b), labels[i], r, g, b, h, s, l])
+            return names
+    except (OSError, struct.error, UnicodeDecodeError, IndexError):
+        pass
+    names = read_palette(source)
+    try:
+        compile_palette(source, names, source_digest)
+    except OSError:
+        pass  # read-only install, keep working from the source
+    return names
+
+
+def compile_palette(source, names, source_digest):
+    '''Write the binary index of a palette next to its source.'''
+    data = [PALETTE_HEADER.pack(PALETTE_MAGIC, source_digest, len(names))]
+    for hex_value, name in names:
+        color = "#" + hex_value
+        data.append(PALETTE_ENTRY.pack(*(NTC.rgb(color) + NTC.hsl(color))))
+    data.append("\n".join(name for hex_value, name in names).encode('utf-8'))
+    index_file = palette_file(source, '.ktxpal')
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    tmp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(b''.join(data))
+    os.replace(tmp_file, index_file)
+
+
+def open_lut(lut_file, digest):
+    '''Memory-map a lookup table built by build_lut, or None if it is missing
+    or was built from a different palette.'''
+    if lut_file is None:
+        return None
+    try:
+        with open(lut_file, 'rb') as f:
+            lut = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(lut) != LUT_HEADER.size + 2 * (1 << 24) or LUT_HEADER.unpack_from(lut)[:2] != (LUT_MAGIC, digest):
+        lut.close()
+        return None
+    return lut
+
+
+def build_lut(palette=DEFAULT_PALETTE):
+    '''Write the palette index of the nearest name for every 24-bit color.'''
+    ntc = NTC(palette, use_lut=False)
+    lut_file = palette_file(ntc.source, '.lut')
+    os.makedirs(os.path.dirname(lut_file), exist_ok=True)
+    if not 0 < len(ntc.names) <= LUT_EXACT:
+        raise ValueError(f"Palette size not supported by a lookup table: {len(ntc.names)} colors")
+    tmp_file = f"{lut_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(LUT_HEADER.pack(LUT_MAGIC, ntc.digest(), len(ntc.names)))
+        for red in range(256):
+            colors = ["#%06X" % (red << 16 | green_blue) for green_blue in range(1 << 16)]
+            values = array('H', (cl | LUT_EXACT if exact else cl for cl, exact in ntc.nearest_many(colors)))
+            if sys.byteorder != 'little':
+                values.byteswap()
+            values.tofile(f)
+    os.replace(tmp_file, lut_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile color name palettes")
+    parser.add_argument("palettes", nargs="*", default=[DEFAULT_PALETTE], help="Palette names or files")
+    parser.add_argument("--lut", action="store_true", help="Also build the 24-bit lookup table")
+    args = parser.parse_args()
+    for palette in args.palettes:
+        if args.lut:
+            build_lut(palette)
+        else:
+            load_palette(palette_source(palette))
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+In-process versions of Inkscape path operations, so the extensions do not have
+to start Inkscape for them
+"""
+import inkex
+from inkex import Path, PathElement, Transform
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Attributes that only describe the geometry of a shape, dropped once it is a path
+GEOMETRY = {
+    'path': ('d',),
+    'rect': ('x', 'y', 'width', 'height', 'rx', 'ry'),
+    'circle': ('cx', 'cy', 'r'),
+    'ellipse': ('cx', 'cy', 'rx', 'ry'),
+    'line': ('x1', 'y1', 'x2', 'y2'),
+    'polyline': ('points',),
+    'polygon': ('points',),
+}
+# Paths whose data Inkscape derives from other attributes (arcs, stars, spirals,
+# path effects); left to Inkscape
+DERIVED = (inkex.addNS('type', 'sodipodi'), inkex.addNS('path-effect', 'inkscape'))
+IDENTITY = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0))
+TOLERANCE = 0.01  # how far a flattened curve may be off, in user units
+
+
+def local_name(element):
+    return element.tag.split('}')[-1] if isinstance(element.tag, str) else None
+
+
+def number(value):
+    '''Path data number with the 8 significant digits Inkscape writes.'''
+    return format(value, '.8g')
+
+
+def can_combine(elements):
+    '''Whether combine() handles all of elements. Text, images, clones and
+    groups need Inkscape to be turned into paths.'''
+    return len(elements) > 0 and all(
+        local_name(element) in GEOMETRY and not any(element.attrib.get(attr) is not None for attr in DERIVED)
+        for element in elements)
+
+
+def corners(element, tag):
+    '''Points of a plain rect, line, polyline or polygon and whether it is
+    closed, or None when the shape needs the general path conversion.'''
+    try:
+        if tag == 'rect':
+            if element.attrib.get('rx') or element.attrib.get('ry'):
+                return None
+            x, y = float(element.attrib.get('x', 0)), float(element.attrib.get('y', 0))
+            width, height = float(element.attrib.get('width', 0)), float(element.attrib.get('height', 0))
+            return [(x, y), (x + width, y), (x + width, y + height), (x, y + height)], True
+        if tag == 'line':
+            return [(float(element.attrib.get('x1', 0)), float(element.attrib.get('y1', 0))),
+                    (float(element.attrib.get('x2', 0)), float(element.attrib.get('y2', 0)))], False
+        if tag in ('polyline', 'polygon'):
+            values = [float(value) for value in element.attrib.get('points', '').replace(',', ' ').split()]
+            return list(zip(values[0::2], values[1::2])), tag == 'polygon'
+    except ValueError:
+        pass
+    return None
+
+
+def radii(element, tag):
+    '''Center and radii of a circle or ellipse, or None.'''
+    try:
+        if tag == 'circle':
+            radius = float(element.attrib.get('r', 0))
+            return float(element.attrib.get('cx', 0)), float(element.attrib.get('cy', 0)), radius, radius
+        if tag == 'ellipse':
+            rx = float(element.attrib.get('rx', element.attrib.get('ry', 0)))
+            ry = float(element.attrib.get('ry', rx))
+            return float(element.attrib.get('cx', 0)), float(element.attrib.get('cy', 0)), rx, ry
+    except ValueError:
+        pass
+    return None
+
+
+def path_data(element, tag, transform):
+    '''Absolute path data of element, with transform (a matrix) applied.
+    Shapes are drawn clockwise like Inkscape does, so overlapping ones stay
+    filled under the nonzero fill rule.'''
+    ellipse = radii(element, tag)
+    if ellipse is not None:
+        cx, cy, rx, ry = ellipse
+        if rx <= 0 or ry <= 0:
+            return ''
+        ((a, c, e), (b, d, f)) = transform
+        if b != 0 or c != 0:
+            path = Path(f'M {cx + rx},{cy} A {rx},{ry} 0 1 1 {cx - rx},{cy} A {rx},{ry} 0 1 1 {cx + rx},{cy} Z')
+            return commands(path.transform(Transform(transform)))
+        cx, cy, rx, ry = a * cx + e, d * cy + f, abs(a) * rx, abs(d) * ry
+        sweep = '1' if a * d > 0 else '0'  # mirroring turns it around
+        arc = f' A {number(rx)},{number(ry)} 0 1 {sweep} '
+        return (f'M {number(cx + rx)},{number(cy)}' + arc + f'{number(cx - rx)},{number(cy)}'
+                + arc + f'{number(cx + rx)},{number(cy)} Z')
+
+    simple = corners(element, tag)
+    if simple is not None:
+        points, closed = simple
+        if not points:
+            return ''
+        if transform != IDENTITY:
+            ((a, c, e), (b, d, f)) = transform
+            points = [(a * x + c * y + e, b * x + d * y + f) for x, y in points]
+        data = 'M ' + ' L '.join(number(x) + ',' + number(y) for x, y in points)
+        return data + ' Z' if closed else data
+
+    path = Path(element.attrib.get('d', '')) if tag == 'path' else element.path
+    if transform != IDENTITY:
+        path = path.transform(Transform(transform))
+    return commands(path)
+
+
+def commands(path):
+    return ' '.join((command.letter + ' ' + ' '.join(number(arg) for arg in command.args)).strip()
+                    for command in path.to_absolute())
+
+
+def relative_paths(elements, target):
+    '''Absolute path data of each of elements in the coordinate system of
+    target, one of them.'''
+    inverse = -target.composed_transform()
+    relative = {}  # parent -> matrix from its coordinates to those of target
+    for element in elements:
+        if element is target:
+            transform = IDENTITY
+        else:
+            parent = element.getparent()
+            if parent not in relative:
+                matrix = (inverse @ parent.composed_transform()).matrix
+                relative[parent] = IDENTITY if Transform(matrix) == Transform() else matrix
+            transform = relative[parent]
+            if element.attrib.get('transform'):
+                transform = (Transform(transform) @ Transform(element.attrib.get('transform'))).matrix
+        yield path_data(element, local_name(element), transform)
+
+
+def replace(elements, target, data):
+    '''Put a path with data in place of target, keeping its id, style,
+    transform and other attributes, and remove the other elements.'''
+    result = PathElement()
+    geometry = GEOMETRY[local_name(target)]
+    for name, value in target.attrib.items():
+        if name not in geometry:
+            result.set(name, value)
+    result.set('d', data)
+    target.getparent().replace(target, result)
+    for element in elements:
+        if element is not target:
+            element.getparent().remove(element)
+    return result
+
+
+def combine(elements):
+    '''Combine shapes into one path like Inkscape's object-to-path and
+    path-combine. elements are given bottom to top (document order). The path
+    replaces the top-most one, keeping its id, style, transform and other
+    attributes, and the other elements are removed. The path data of each
+    element is brought into the coordinate system of the top-most one and
+    appended from the top down, as Inkscape does. Returns the new path.'''
+    first = elements[-1]
+    parts = relative_paths(list(reversed(elements)), first)
+    return replace(elements, first, ' '.join(part for part in parts if part))
+
+
+def union(elements, tolerance=TOLERANCE):
+    '''Union of the filled areas of shapes like Inkscape's path-union, as one
+    path that replaces the bottom-most element (elements are given in
+    document order). Curves are flattened to within tolerance user units.
+    Raises ValueError, leaving the document alone, when NumPy is missing or
+    the outline cannot be traced.'''
+    if np is None:
+        raise ValueError("NumPy is needed for the polygon union")
+    if not can_combine(elements):
+        raise ValueError("Only shapes and paths can be united in-process")
+    target = elements[0]
+    rings, owners, evenodd = [], [], []
+    for index, (element, data) in enumerate(zip(elements, relative_paths(elements, target))):
+        for ring in flatten(data, tolerance):
+            if len(ring) > 2:
+                rings.append(ring)
+                owners.append(index)
+        evenodd.append((element.style.get('fill-rule') or element.attrib.get('fill-rule')) == 'evenodd')
+    loops = outline(rings, owners, evenodd)
+    data = ' '.join('M ' + ' L '.join(number(x) + ',' + number(y) for x, y in loop) + ' Z' for loop in loops)
+    return replace(elements, target, data)
+
+
+def flatten(data, tolerance):
+    '''Polygons of each subpath of path data, with the curves cut into as many
+    straight pieces as Wang's formula asks for the tolerance.'''
+    rings = []
+    for subpath in Path(data).to_superpath():
+        points = [subpath[0][1]]
+        for previous, current in zip(subpath, subpath[1:]):
+            p0, p1, p2, p3 = previous[1], previous[2], current[0], current[1]
+            if p1 == p0 and p2 == p3:
+                points.append(p3)
+                continue
+            bend = max(abs(p0[0] - 2 * p1[0] + p2[0]), abs(p0[1] - 2 * p1[1] + p2[1]),
+                       abs(p1[0] - 2 * p2[0] + p3[0]), abs(p1[1] - 2 * p2[1] + p3[1])) * 2 ** 0.5
+            pieces = max(1, int(np.ceil(np.sqrt(0.75 * bend / tolerance))))
+            t = np.arange(1, pieces + 1)[:, None] / pieces
+            curve = ((1 - t) ** 3 * p0 + 3 * (1 - t) ** 2 * t * np.asarray(p1, dtype=float)
+                     + 3 * (1 - t) * t ** 2 * np.asarray(p2, dtype=float) + t ** 3 * np.asarray(p3, dtype=float))
+            curve[-1] = p3
+            points.extend(curve.tolist())
+        rings.append(points)
+    return rings
+
+
+def outline(rings, owners, evenodd):
+    '''Trace the boundary of the area inside any of the shapes. rings are
+    closed polygons, owners the shape each ring belongs to, evenodd the fill
+    rule of each shape. The plane is cut into horizontal slabs at every
+    vertex and edge crossing, so no edges cross within a slab. The covered
+    intervals of each slab are found by a winding count per shape, and the
+    outline is made of their sides plus the horizontal differences between
+    neighbouring slabs. Loops run clockwise around filled areas (y down) and
+    counterclockwise around holes.'''
+    starts, ends, owner = [], [], []
+    for ring, shape in zip(rings, owners):
+        ring = np.asarray(ring, dtype=float)
+        if len(ring) > 1 and (ring[0] == ring[-1]).all():
+            ring = ring[:-1]
+        starts.append(ring)
+        ends.append(np.roll(ring, -1, axis=0))
+        owner.append(np.full(len(ring), shape))
+    if not starts:
+        return []
+    starts, ends, owner = np.concatenate(starts), np.concatenate(ends), np.concatenate(owner)
+    eps = 1e-9 * max(1.0, float(np.abs(starts).max()))
+
+    # snap y values that are within eps, so touching shapes share their slabs
+    ys = np.unique(np.concatenate([starts[:, 1], ends[:, 1]]))
+    representative = ys[np.concatenate([[0], np.flatnonzero(np.diff(ys) > eps) + 1])]
+    snap = lambda values: representative[np.searchsorted(representative, values + eps, side='right') - 1]
+    y0, y1 = snap(starts[:, 1]), snap(ends[:, 1])
+    keep = y0 != y1  # horizontal edges only separate slabs
+    down = y1 > y0
+    xa = np.where(down, starts[:, 0], ends[:, 0])[keep]
+    xb = np.where(down, ends[:, 0], starts[:, 0])[keep]
+    ya = np.where(down, y0, y1)[keep]
+    yb = np.where(down, y1, y0)[keep]
+    wind = np.where(down, 1, -1)[keep]
+    owner = owner[keep]
+
+    def x_at(edges, y):
+        x = xa[edges] + (y - ya[edges]) * (xb[edges] - xa[edges]) / (yb[edges] - ya[edges])
+        return np.where(ya[edges] == y, xa[edges], np.where(yb[edges] == y, xb[edges], x))
+
+    def cover(edges, top, bottom):
+        '''Covered intervals between top and bottom, as (left top x, left
+        bottom x, right top x, right bottom x).'''
+        xt, xbm = x_at(edges, top), x_at(edges, bottom)
+        windings = {}
+        covered = 0
+        intervals = []
+        for k in np.argsort(xt + xbm, kind='stable'):
+            shape = owner[edges[k]]
+            before = windings.get(shape, 0)
+            after = before + wind[edges[k]]
+            windings[shape] = after
+            was, now = (before % 2, after % 2) if evenodd[shape] else (before != 0, after != 0)
+            if was == now:
+                continue
+            if now:
+                covered += 1
+                if covered == 1:
+                    left = k
+            else:
+                covered -= 1
+                if covered == 0:
+                    if intervals and abs(intervals[-1][2] - xt[left]) <= eps and abs(intervals[-1][3] - xbm[left]) <= eps:
+                        intervals[-1] = intervals[-1][:2] + (xt[k], xbm[k])  # touching, join them
+                    elif xt[k] - xt[left] > eps or xbm[k] - xbm[left] > eps:
+                        intervals.append((xt[left], xbm[left], xt[k], xbm[k]))
+        return intervals
+
+    slabs = []  # (top, bottom, intervals)
+    order = np.argsort(ya, kind='stable')
+    sorted_tops = ya[order]
+    active = np.empty(0, dtype=int)
+    cursor = 0
+    for top, bottom in zip(representative[:-1], representative[1:]):
+        end = np.searchsorted(sorted_tops, top, side='right')
+        if end > cursor:
+            active = np.concatenate([active, order[cursor:end]])
+            cursor = end
+        active = active[yb[active] > top]
+        if len(active) == 0:
+            slabs.append((top, bottom, []))
+            continue
+        cuts = [top, bottom]
+        xt, xbm = x_at(active, top), x_at(active, bottom)
+        if np.any(np.diff(xbm[np.lexsort((xbm, xt))]) < 0):  # some edges cross
+            dt = xt[:, None] - xt[None, :]
+            db = xbm[:, None] - xbm[None, :]
+            i, j = np.nonzero(np.triu(dt * db < 0))
+            crossing = top + dt[i, j] / (dt[i, j] - db[i, j]) * (bottom - top)
+            crossing = np.unique(crossing[(crossing > top + eps) & (crossing < bottom - eps)])
+            cuts = [top] + list(crossing) + [bottom]
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            slabs.append((a, b, cover(active, a, b)))
+
+    # one point found on two edges can differ in the last bits, so make the x
+    # values within eps at each y the same
+    found = {}
+    for top, bottom, intervals in slabs:
+        for left_top, left_bottom, right_top, right_bottom in intervals:
+            found.setdefault(top, set()).update((left_top, right_top))
+            found.setdefault(bottom, set()).update((left_bottom, right_bottom))
+    snapped = {}
+    for y, xs in found.items():
+        previous = None
+        for x in sorted(xs):
+            if previous is None or x - previous > eps:
+                representative = x
+            snapped[x, y] = representative
+            previous = x
+    slabs = [(top, bottom, [(snapped[lt, top], snapped[lb, bottom], snapped[rt, top], snapped[rb, bottom])
+                            for lt, lb, rt, rb in intervals])
+             for top, bottom, intervals in slabs]
+
+    segments = []
+    for top, bottom, intervals in slabs:
+        for left_top, left_bottom, right_top, right_bottom in intervals:
+            segments.append(((left_bottom, bottom), (left_top, top)))
+            segments.append(((right_top, top), (right_bottom, bottom)))
+    above = []
+    for top, bottom, intervals in slabs + [(None, None, [])]:
+        y = top if top is not None else slabs[-1][1]
+        below = [(interval[0], interval[2]) for interval in intervals]
+        segments.extend(horizontal(above, below, y))
+        above = [(interval[1], interval[3]) for interval in intervals]
+    return [loop for loop in (simplify(loop, eps) for loop in chain(segments)) if len(loop) > 2]
+
+
+def horizontal(above, below, y):
+    '''Outline segments along y between the intervals covered just above and
+    just below it, running +x where only the area below is covered.'''
+    events = sorted([(x, 0, step) for interval in above for x, step in zip(interval, (1, -1))]
+                    + [(x, 1, step) for interval in below for x, step in zip(interval, (1, -1))])
+    covered = [0, 0]
+    segments = []
+    for index, (x, side, step) in enumerate(events[:-1]):
+        covered[side] += step
+        end = events[index + 1][0]
+        if end == x:
+            continue
+        if covered[1] > 0 and covered[0] <= 0:
+            segments.append(((x, y), (end, y)))
+        elif covered[0] > 0 and covered[1] <= 0:
+            segments.append(((end, y), (x, y)))
+    return segments
+
+
+def chain(segments):
+    '''Join segments into closed loops of points.'''
+    outgoing = {}
+    for index, (start, end) in enumerate(segments):
+        outgoing.setdefault(start, []).append(index)
+    used = [False] * len(segments)
+    loops = []
+    for first in range(len(segments)):
+        if used[first]:
+            continue
+        loop = []
+        index = first
+        while index is not None:
+            used[index] = True
+            start, end = segments[index]
+            loop.append(start)
+            index = next((k for k in outgoing.get(end, ()) if not used[k]), None)
+        if end != segments[first][0]:
+            raise ValueError("The outline does not close")
+        loops.append(loop)
+    return loops
+
+
+def simplify(loop, eps):
+    '''Drop the points of a loop that lie on the line between their
+    neighbours.'''
+    changed = True
+    while changed and len(loop) > 2:
+        changed = False
+        kept = []
+        for index, (x, y) in enumerate(loop):
+            px, py = kept[-1] if kept else loop[index - 1]
+            nx, ny = loop[(index + 1) % len(loop)]
+            dx, dy = nx - px, ny - py
+            length = (dx * dx + dy * dy) ** 0.5
+            if length <= eps or (abs(dx * (y - py) - dy * (x - px)) <= eps * length
+                                 and -eps <= (x - px) * dx + (y - py) * dy <= length * length + eps):
+                changed = True
+                continue
+            kept.append((x, y))
+        loop = kept
+    return loop
@@ -4,6 +4,7 @@ import inkex
 from lxml import etree
 from math import floor
 from inkex import Color
+from ktx_colors import hsl_color
 
 
 class KTX_RandomFillColor(inkex.EffectExtension):
@@ -13,7 +14,6 @@ class KTX_RandomFillColor(inkex.EffectExtension):
 
     def effect(self):
         svg = self.document.getroot()
-        document = self.svg.xpath('//svg:*', namespaces=inkex.NSS)
         number_of_selected_objects = len(svg.selection)
         satu = self.options.satu
         valu = self.options.valu
@@ -22,11 +22,7 @@ class KTX_RandomFillColor(inkex.EffectExtension):
         if number_of_selected_objects > 0:
             incr = floor(255/number_of_selected_objects)
             for elem in svg.selection:
-                col = Color("#ff0000")
-                col.hue = hue
-                col.saturation = satu
-                col.lightness = valu
-                elem.style['fill'] = col
+                elem.style['fill'] = hsl_color(hue, satu, valu)
                 hue+=incr
         else:
             self.msg(f"Select some objects, dumbass!")
@@ -6,14 +6,11 @@
 """
 Provide the Scrabble Tiles
 """
-import os
-import random
-import string
 import inkex
-from inkex import etree
 from inkex import Rectangle, TextElement, PathElement, Circle, Line
 from inkex.elements import Group
-from tempfile import TemporaryDirectory
+from ktx_inkscape import run_inkscape_and_replace_svg
+from ktx_pathops import combine, union
 from inkex.localization import (
     inkex_gettext as _,
     inkex_fgettext as _f,
@@ -94,29 +91,24 @@ def draw_CharValue(x, y, font_size, font_family, font_bold, character, parent):
     return elem
 
 
-def run_inkscape_and_replace_svg(svg, action_str):
-    '''Invoke a set of actions in a child Inkscape then replace the current
-    SVG contents with those of the child Inkscape.'''
-
-    with TemporaryDirectory(prefix='inkscape-command-') as tmpdir:
-        svg_file = inkex.command.write_svg(svg, tmpdir, 'input.svg')
-
-        cwd = os.getcwd()
-        os.chdir(os.path.dirname(svg_file))
-
-        args = ['--batch-process']
-        if action_str[0].strip().islower():
-            instance_tag = ''.join(random.choices(string.ascii_letters, k=10))
-            args.append(f'--app-id-tag={instance_tag}')
-        inkex.command.inkscape(svg_file,
-                               *args,
-                               actions=action_str)
-        os.chdir(cwd)
-        for element in svg:
-            svg.remove(element)
-        append_tree = etree.parse(svg_file)
-        for element in append_tree.getroot():
-            svg.append(element)
+def merge_shapes(elements, label, action_chunks):
+    '''Unite elements into one labelled path in-process, or add the Inkscape
+    actions that do it to action_chunks. The path gets an id, as the shapes
+    it replaces may have none.'''
+    if not elements:
+        return
+    try:
+        shape = union(elements)
+        shape.label = label
+        shape.get_id()
+    except ValueError:
+        action_chunks.extend(['select-by-id:' + elem.get_id() for elem in elements])
+        action_chunks.extend(['object-to-path'])
+        action_chunks.extend(['path-union'])
+        action_chunks.extend(['select-clear'])
+        action_chunks.extend(['select-by-id:' + elements[0].get_id()])
+        action_chunks.extend(['object-set-attribute:inkscape:label, ' + label])
+        action_chunks.extend(['select-clear'])
 
 
 class KTXScrabbleTiles(inkex.EffectExtension):
@@ -204,7 +196,7 @@ class KTXScrabbleTiles(inkex.EffectExtension):
                                  character,
                                  cl)
                 if enable_merge:
-                    tiles_list.append(tile.get_id())
+                    tiles_list.append(tile)
                 else:
                     groups['Tiles'].add(tile)
 
@@ -232,7 +224,7 @@ class KTXScrabbleTiles(inkex.EffectExtension):
                                    character,
                                    cl)
                     if enable_merge:
-                        lines_list.append(vl.get_id())
+                        lines_list.append(vl)
                     else:
                         groups['Lines'].add(vl)
 
@@ -245,7 +237,7 @@ class KTXScrabbleTiles(inkex.EffectExtension):
                                    character,
                                    cl)
                     if enable_merge:
-                        lines_list.append(hl.get_id())
+                        lines_list.append(hl)
                     else:
                         groups['Lines'].add(hl)
 
@@ -256,7 +248,7 @@ class KTXScrabbleTiles(inkex.EffectExtension):
                                    character,
                                    cl)
                     if enable_merge:
-                        dots_list.append(dot.get_id())
+                        dots_list.append(dot)
                     else:
                         groups['Dots'].add(dot)
 
@@ -276,48 +268,33 @@ class KTXScrabbleTiles(inkex.EffectExtension):
                 x += tile_size
 
         if enable_merge:
-            action_chunks.extend(['select-by-id:' + obj_id for obj_id in tiles_list])
-            action_chunks.extend(['object-to-path'])
-            action_chunks.extend(['path-union'])
-            action_chunks.extend(['select-clear'])
-            action_chunks.extend(['select-by-id:' + obj_id for obj_id in text_list])
-            action_chunks.extend(['path-union'])
-            action_chunks.extend(['select-clear'])
-            action_chunks.extend(['select-by-id:' + obj_id for obj_id in lines_list])
-            action_chunks.extend(['path-combine'])
-            action_chunks.extend(['select-clear'])
-            if enable_dots:
-                action_chunks.extend(['select-by-id:' + obj_id for obj_id in dots_list])
+            if lines_list:
+                lines = combine(lines_list)
+                lines.label = "Lines"
+                lines.get_id()
+
+            merge_shapes(tiles_list, "Outline", action_chunks)
+            if text_list:
+                action_chunks.extend(['select-by-id:' + obj_id for obj_id in text_list])
                 action_chunks.extend(['path-union'])
                 action_chunks.extend(['select-clear'])
-            if enable_scrabblevalue:
+            if enable_dots:
+                merge_shapes(dots_list, "Dots", action_chunks)
+            if enable_scrabblevalue and values_list:
                 action_chunks.extend(['select-by-id:' + obj_id for obj_id in values_list])
                 action_chunks.extend(['path-union'])
                 action_chunks.extend(['select-clear'])
 
-            action_chunks.extend(['select-by-id:' + tiles_list[0]])
-            action_chunks.extend(['object-set-attribute:inkscape:label, Outline'])
-            action_chunks.extend(['select-clear'])
-            action_chunks.extend(['select-by-id:' + text_list[0]])
-            action_chunks.extend(['object-set-attribute:inkscape:label, Text'])
-            action_chunks.extend(['select-clear'])
-            action_chunks.extend(['select-by-id:' + lines_list[-1]])
-            action_chunks.extend(['object-set-attribute:inkscape:label, Lines'])
-            action_chunks.extend(['select-clear'])
-            if enable_dots:
-                action_chunks.extend(['select-by-id:' + dots_list[0]])
-                action_chunks.extend(['object-set-attribute:inkscape:label, Dots'])
+            if text_list:
+                action_chunks.extend(['select-by-id:' + text_list[0]])
+                action_chunks.extend(['object-set-attribute:inkscape:label, Text'])
                 action_chunks.extend(['select-clear'])
-            if enable_scrabblevalue:
+            if enable_scrabblevalue and values_list:
                 action_chunks.extend(['select-by-id:' + values_list[0]])
                 action_chunks.extend(['object-set-attribute:inkscape:label, Values'])
                 action_chunks.extend(['select-clear'])
-            action_chunks.extend(['export-filename:input.svg',
-                                  'export-overwrite',
-                                  'export-do',
-                                  'quit-immediate'])
-            action_str = ';'.join(action_chunks)
-            run_inkscape_and_replace_svg(svg, action_str)
+            if action_chunks:
+                run_inkscape_and_replace_svg(svg, action_chunks)
         else:
             for group_name, group in groups.items():
                 if len(group) > 0:
@@ -4,6 +4,8 @@ from lxml import etree
 from math import sqrt
 from inkex import PathElement, Path, Group, Color
 from inkex import colors
+from ktx_colors import parse_color, unpack_color
+from ktx_fills import FillIndex
 
 class KTX_Similar_Fill(inkex.EffectExtension):
     def add_arguments(self, pars):
@@ -38,7 +40,8 @@ class KTX_Similar_Fill(inkex.EffectExtension):
         return sqrt(dist)
 
     def hex_to_rgba(self, col):
-        return f"rgba({Color(col).red},{Color(col).green},{Color(col).blue},1)"
+        r, g, b, a = unpack_color(parse_color(col))
+        return f"rgba({r},{g},{b},1)"
 
     def col_distance(self, source, target):
         r_diff = source.red - target.red
@@ -50,7 +53,6 @@ class KTX_Similar_Fill(inkex.EffectExtension):
 
     def effect(self):
         svg = self.document.getroot()
-        document = self.svg.xpath('//svg:*', namespaces=inkex.NSS)
         
         target_rgba = self.options.target_color
         target_hex = self.color_to_hex(self.options.target_color)
@@ -58,22 +60,20 @@ class KTX_Similar_Fill(inkex.EffectExtension):
         preview = self.options.live_preview
 
         matched = []
+        target = (target_rgba.red, target_rgba.green, target_rgba.blue, target_rgba.alpha)
+        index = FillIndex(svg, groups=True)
+        distances = {}
 
-        if len(svg.selection) == 0:
-            looper = document
-        else:
-            looper = svg.selection
-
-        for element in looper:
-            tag = element.tag.split('}')[-1]
-            if tag in ['svg', 'defs']:
-                continue
+        for element, fill in index.elements:
             id_attr = element.get('id', 'no-id')
-            style = element.style if hasattr(element, 'style') else 'no-style'
-            attribs = dict(element.attrib)
             # self.msg(f"{self.hex_to_rgba(element.style.get('fill'))}")
             # self.msg(f"{Color(element.style.get('fill')).red}")
-            distance = self.col_distance(Color(element.style.get('fill')), self.options.target_color)
+            if fill not in distances:
+                rgba = index.rgba(fill)
+                distances[fill] = None if rgba is None else self.color_distance(rgba, target, True)
+            distance = distances[fill]
+            if distance is None:
+                continue
             # self.msg(f"{distance}")
             if distance <= threshold:
                 element.style["fill"] = target_hex # "#ff0000"
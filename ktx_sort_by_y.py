@@ -3,6 +3,7 @@
 
 import inkex
 from lxml import etree
+from ktx_fills import iter_shapes
 
 
 class KTX_Sort_By_Y(inkex.EffectExtension):
@@ -12,19 +13,19 @@ class KTX_Sort_By_Y(inkex.EffectExtension):
 
     def effect(self):
         svg = self.document.getroot()
-        document = self.svg.xpath('//svg:*', namespaces=inkex.NSS)
         number_of_selected_objects = len(svg.selection)
         vb = svg.get('viewBox').split(' ')
         xh = float(vb[2])/2.0
         elems = []
-        looper = svg.selection if number_of_selected_objects > 0 else document
+        looper = svg.selection if number_of_selected_objects > 0 else iter_shapes(svg)
         for elem in looper:
             tag = elem.tag.split('}')[-1]
             if tag in ['svg', 'defs', 'g']:
                continue
             posy = float(elem.get('y'))
             elems.append([posy,elem])
-            elem.delete()
+        for element in elems:
+            element[1].delete()
         elems = sorted(elems, key=lambda x:x[0], reverse=True)
         for element in elems:
             svg.append(element[1])
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# coding=utf-8
+#
+# Copyright (C) 2025 Roel Koster
+#
+"""
+Headless streaming mode for huge SVG files
+
+Relabels shapes with their fill color name, or regroups them by fill like
+KTX Combine Same Fill Colors (group only), while the file is parsed. Output
+is written as it goes, so the whole document is never held in memory.
+
+Fills come from the style and fill attributes of a shape and its parents,
+or the tspans of a text, as in the extensions, but stylesheets and
+gradients, which may be defined anywhere in the file, are not looked at.
+Images and clones get no fill, so grouping leaves them where they are.
+Comments, processing instructions and the whitespace between elements
+inside containers are not copied to the output. Usage:
+
+    python3 ktx_stream.py colorname [--append] [--palette ntc] input.svg output.svg
+    python3 ktx_stream.py combine input.svg output.svg
+"""
+import argparse
+import re
+import struct
+from tempfile import TemporaryFile
+from xml.sax.saxutils import escape
+
+import inkex
+from lxml import etree
+from ktx_fills import CONTAINER_TAGS, SHAPE_TAGS, SVG_PREFIX, normalize_fill
+from ktx_ntc import NTC
+
+INKSCAPE_LABEL = f"{{{inkex.NSS['inkscape']}}}label"
+RECORD = struct.Struct('<Q')  # length of a spilled element
+
+
+def local_tag(element):
+    tag = element.tag
+    if isinstance(tag, str) and tag.startswith(SVG_PREFIX):
+        return tag[len(SVG_PREFIX):]
+    return None
+
+
+def value_of(element, name):
+    '''Value of a presentation property, from the style or the attribute of
+    element or its nearest parent that sets it, None when none does.'''
+    while element is not None and isinstance(element.tag, str):
+        value = inkex.Style(element.get('style', '')).get(name)
+        if value is None:
+            value = element.get(name)
+        value = normalize_fill(value)
+        if value is not None and value != 'inherit':
+            return value
+        element = element.getparent()
+    return None
+
+
+def fill_of(element):
+    if local_tag(element) in ('image', 'use'):
+        return None
+    fill = value_of(element, 'fill')
+    if fill is None and local_tag(element) == 'text':
+        for span in element.iter(f"{SVG_PREFIX}tspan"):
+            fill = value_of(span, 'fill')
+            if fill is not None:
+                element = span
+                break
+    if fill == 'currentcolor':
+        fill = value_of(element, 'color')
+    return '#000000' if fill is None else fill
+
+
+def declarations(nsmap):
+    '''The xmlns attributes lxml writes for nsmap, as bytes.'''
+    return [b' xmlns%s="%s"' % (b'' if prefix is None else b':' + prefix.encode('utf-8'),
+                                escape(uri, {'"': '&quot;'}).encode('utf-8'))
+            for prefix, uri in nsmap.items()]
+
+
+class Writer:
+    '''Serializes elements to the output without the namespace declarations
+    that the root already makes, which lxml repeats on every subtree.'''
+
+    def __init__(self, out):
+        self.out = out
+        self.declared = []
+
+    def dumps(self, element):
+        data = etree.tostring(element, with_tail=False)
+        end = data.index(b'>')
+        head = data[:end]
+        for declaration in self.declared:
+            head = head.replace(declaration, b'', 1)
+        return head + data[end:]
+
+    def write(self, element):
+        self.out.write(self.dumps(element))
+
+    def start(self, element):
+        '''Write the start tag of element and return its end tag.'''
+        tag = self.dumps(etree.Element(element.tag, dict(element.attrib), nsmap=element.nsmap))
+        self.out.write(tag[:-2].rstrip() + b'>')
+        if not self.declared:
+            self.declared = declarations(element.nsmap)
+        return b'</' + re.match(rb'<([^\s/>]+)', tag).group(1) + b'>'
+
+
+def stream(source, target, handle_shape, finish=None):
+    '''Copy source to target one element at a time. Containers (svg, g, a,
+    switch) are written as they open and close; every other element is read
+    whole and written in place, except the rendered shapes, which are passed
+    to handle_shape(element, writer) instead. finish(writer) runs just
+    before the root element is closed.'''
+    with open(target, 'wb') as out:
+        writer = Writer(out)
+        end_tags = []
+        buffered = None
+
+        out.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+        for event, element in etree.iterparse(source, events=('start', 'end'), huge_tree=True):
+            if buffered is not None:
+                if event == 'end' and element is buffered:
+                    if local_tag(element) in SHAPE_TAGS:
+                        handle_shape(element, writer)
+                    else:
+                        writer.write(element)
+                    buffered = None
+                    # drop what has been written so memory stays flat
+                    element.clear(keep_tail=True)
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+                continue
+            if event == 'start':
+                if local_tag(element) in CONTAINER_TAGS:
+                    end_tags.append(writer.start(element))
+                else:
+                    buffered = element
+            else:
+                if len(end_tags) == 1 and finish is not None:
+                    finish(writer)
+                out.write(end_tags.pop())
+                element.clear(keep_tail=True)
+        out.write(b'\n')
+
+
+def stream_colorname(source, target, palette='ntc', append=False):
+    ntc = NTC(palette)
+
+    def relabel(element, writer):
+        fill = fill_of(element)
+        if fill and fill[0] == '#':
+            color_name = ntc.name(fill)
+            if append:
+                prefix = element.get(INKSCAPE_LABEL) or element.get('id', 'no-id')
+                element.set(INKSCAPE_LABEL, prefix + " - " + color_name)
+            else:
+                element.set(INKSCAPE_LABEL, color_name)
+        writer.write(element)
+
+    stream(source, target, relabel)
+
+
+def stream_combine(source, target):
+    '''Move every shape into a group per fill at the end of the document.
+    Shapes are spilled to a temporary file until their group is written,
+    and copied back as bytes, one element at a time.'''
+    with TemporaryFile() as spill:
+        groups = {}  # fill -> [(offset, length)], in order of first appearance
+
+        def collect(element, writer):
+            fill = fill_of(element)
+            if fill is None:  # images and clones stay in place
+                writer.write(element)
+                return
+            data = writer.dumps(element)
+            groups.setdefault(fill, []).append((spill.tell() + RECORD.size, len(data)))
+            spill.write(RECORD.pack(len(data)))
+            spill.write(data)
+
+        def write_groups(writer):
+            for fill, records in groups.items():
+                group = etree.Element(f"{SVG_PREFIX}g", {INKSCAPE_LABEL: fill},
+                                      nsmap={None: inkex.NSS['svg'], 'inkscape': inkex.NSS['inkscape']})
+                end_tag = writer.start(group)
+                for offset, length in records:
+                    spill.seek(offset)
+                    writer.out.write(spill.read(length))
+                writer.out.write(end_tag)
+
+        stream(source, target, collect, write_groups)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process huge SVG files without loading them whole")
+    commands = parser.add_subparsers(dest="command", required=True)
+    colorname = commands.add_parser("colorname", help="Set labels to the fill color name")
+    colorname.add_argument("--append", action="store_true", help="Append the name to the existing label")
+    colorname.add_argument("--palette", default="ntc", help="Palette name or CSV/JSON file")
+    combine = commands.add_parser("combine", help="Group shapes by fill color")
+    for command in (colorname, combine):
+        command.add_argument("input")
+        command.add_argument("output")
+    args = parser.parse_args()
+    if args.command == "colorname":
+        stream_colorname(args.input, args.output, args.palette, args.append)
+    else:
+        stream_combine(args.input, args.output)
@@ -3,6 +3,7 @@
 
 import inkex
 from lxml import etree
+from ktx_fills import FillIndex
 
 
 class KTX_Test(inkex.EffectExtension):
@@ -12,13 +13,8 @@ class KTX_Test(inkex.EffectExtension):
 
     def effect(self):
         svg = self.document.getroot()
-        document = self.svg.xpath('//svg:*', namespaces=inkex.NSS)
-        looper = svg.selection if len(svg.selection) > 0 else document
-        for elem in looper:
-            tag = elem.tag.split('}')[-1]
-            if tag in ['svg', 'defs','g']:
-               continue
-            self.msg(f"{elem.style.get('fill')}")
+        for elem, fill in FillIndex(svg).elements:
+            self.msg(f"{fill}")
 
 if __name__ == "__main__":
     KTX_Test().run()
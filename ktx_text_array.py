@@ -6,14 +6,10 @@
 """
 Provide the Scrabble Tiles
 """
-import os
-import random
-import string
 import inkex
-from inkex import etree
 from inkex import Rectangle, TextElement, PathElement, Circle
 from inkex.elements import Group
-from tempfile import TemporaryDirectory
+from ktx_inkscape import run_inkscape_and_replace_svg
 
 TEXT_TEMPLATE = "dominant-baseline: middle;fill: #000000;font-size: %f;font-family: %s;font-weight: %s;-inkscape-font-specification: %s;line-height: 1;paint-order: markers fill stroke;stroke: none;stroke-dasharray: none;stroke-linecap: round;stroke-width: 0.1mm;text-anchor: middle;"
 
@@ -27,31 +23,6 @@ def draw_Character(font_size, font_family, font_bold, character, parent):
     return elem
 
 
-def run_inkscape_and_replace_svg(svg, action_str):
-    '''Invoke a set of actions in a child Inkscape then replace the current
-    SVG contents with those of the child Inkscape.'''
-
-    with TemporaryDirectory(prefix='inkscape-command-') as tmpdir:
-        svg_file = inkex.command.write_svg(svg, tmpdir, 'input.svg')
-
-        cwd = os.getcwd()
-        os.chdir(os.path.dirname(svg_file))
-
-        args = ['--batch-process']
-        if action_str[0].strip().islower():
-            instance_tag = ''.join(random.choices(string.ascii_letters, k=10))
-            args.append(f'--app-id-tag={instance_tag}')
-        inkex.command.inkscape(svg_file,
-                               *args,
-                               actions=action_str)
-        os.chdir(cwd)
-        for element in svg:
-            svg.remove(element)
-        append_tree = etree.parse(svg_file)
-        for element in append_tree.getroot():
-            svg.append(element)
-
-
 class KTXTextArray(inkex.EffectExtension):
     def add_arguments(self, pars):
         pars.add_argument("--start_x", type=float, default=0.0)
@@ -123,12 +94,7 @@ class KTXTextArray(inkex.EffectExtension):
             action_chunks.extend(['select-by-id:' + text_list[0]])
             action_chunks.extend(['object-set-attribute:inkscape:label, Text'])
             action_chunks.extend(['select-clear'])
-            action_chunks.extend(['export-filename:input.svg',
-                                  'export-overwrite',
-                                  'export-do',
-                                  'quit-immediate'])
-            action_str = ';'.join(action_chunks)
-            run_inkscape_and_replace_svg(svg, action_str)
+            run_inkscape_and_replace_svg(svg, action_chunks)
         else:
             for group_name, group in groups.items():
                 if len(group) > 0:
@@ -6,15 +6,11 @@
 """
 Provide the Watch Numbers
 """
-import os
 import math
-import random
-import string
 import inkex
-from inkex import etree
 from inkex import TextElement, PathElement, Circle
 from inkex.elements import Group
-from tempfile import TemporaryDirectory
+from ktx_inkscape import run_inkscape_and_replace_svg
 from inkex.localization import (
     inkex_gettext as _,
     inkex_fgettext as _f,
@@ -76,31 +72,6 @@ def draw_Dot(x, y, radius, name, parent):
     elem.set("r", radius)
     return elem
 
-def run_inkscape_and_replace_svg(svg, action_str):
-    '''Invoke a set of actions in a child Inkscape then replace the current
-    SVG contents with those of the child Inkscape.'''
-
-    with TemporaryDirectory(prefix='inkscape-command-') as tmpdir:
-        svg_file = inkex.command.write_svg(svg, tmpdir, 'input.svg')
-
-        cwd = os.getcwd()
-        os.chdir(os.path.dirname(svg_file))
-
-        args = ['--batch-process']
-        if action_str[0].strip().islower():
-            instance_tag = ''.join(random.choices(string.ascii_letters, k=10))
-            args.append(f'--app-id-tag={instance_tag}')
-        inkex.command.inkscape(svg_file,
-                               *args,
-                               actions=action_str)
-        os.chdir(cwd)
-        for element in svg:
-            svg.remove(element)
-        append_tree = etree.parse(svg_file)
-        for element in append_tree.getroot():
-            svg.append(element)
-
-
 class KTXWatchNumbers(inkex.EffectExtension):
     def add_arguments(self, pars):
         pars.add_argument("--start_x", type=float, default=0.0)
@@ -220,12 +191,7 @@ class KTXWatchNumbers(inkex.EffectExtension):
             action_chunks.extend(['object-set-attribute:inkscape:label, Values'])
             action_chunks.extend(['select-clear'])
  
-            action_chunks.extend(['export-filename:input.svg',
-                                  'export-overwrite',
-                                  'export-do',
-                                  'quit-immediate'])
-            action_str = ';'.join(action_chunks)
-            run_inkscape_and_replace_svg(svg, action_str)
+            run_inkscape_and_replace_svg(svg, action_chunks)
         else:
             for group_name, group in groups.items():
                 if len(group) > 0:
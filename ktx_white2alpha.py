@@ -1,102 +1,187 @@
 #!/usr/bin/env python3
 import inkex
-from PIL import Image
-from io import BytesIO
-import base64
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlparse
+from urllib.request import url2pathname
+from PIL import features
+from ktx_bitmap import MIME_TYPES, PALETTES, process_image, payload_key, file_key
+from ktx_cache import ResultCache
 
+# Kept on the image in defs, everything else goes on the clones
+SHARED_ATTRIBUTES = ('width', 'height', 'preserveAspectRatio')
+SHARED_NAMES = ('href', inkex.addNS('href', 'xlink')) + SHARED_ATTRIBUTES
 
-def avg(a):
-    return int(sum(a)/len(a))
 
 class KTX_White2Alpha(inkex.EffectExtension):
     """
-    Replaces white in selected embedded images with transparency.
+    Replaces white in selected embedded or linked images with transparency.
     """
 
     def add_arguments(self, pars):
         pars.add_argument("--threshold", type=int, default=15)
         pars.add_argument("--mode", type=int, default=1)
+        pars.add_argument("--strip_height", type=int, default=0, help="Rows per strip, 0 for the whole image at once")
+        pars.add_argument("--workers", type=int, default=0, help="Images processed at once, 0 for one per CPU")
+        pars.add_argument("--share", type=inkex.Boolean, default=False, help="Let identical images share one copy in defs")
+        pars.add_argument("--write_to", default="embed", help="embed: data URI, sidecar: image file next to the document")
+        pars.add_argument("--image_format", default="png", help="png, or webp (lossless)")
+        pars.add_argument("--compress_level", type=int, default=6, help="0 (fast) to 9 (small)")
+        pars.add_argument("--palette", type=inkex.Boolean, default=False, help="Write the masks of mode 4 and 5 as 1-bit PNG")
 
     def effect(self):
         threshold = self.options.threshold
         mode = self.options.mode
+        strip_height = self.options.strip_height
+        workers = self.options.workers or os.cpu_count() or 1
+        level = min(max(self.options.compress_level, 0), 9)
+        image_format = self.options.image_format
+        if image_format == "webp" and strip_height > 0:
+            inkex.errormsg("WebP can not be written in strips. Writing PNG instead.")
+            image_format = "png"
+        elif image_format == "webp" and not features.check('webp'):
+            inkex.errormsg("This Pillow can not write WebP. Writing PNG instead.")
+            image_format = "png"
+        palette = self.options.palette and mode in PALETTES and image_format == "png"
+        sidecar_dir = None
+        if self.options.write_to == "sidecar":
+            sidecar_dir = self.svg_path()
+            if not sidecar_dir:
+                inkex.errormsg("Save the document first to write images next to it. Embedding them instead.")
         selected_images = self.svg.selected.values()
         if not selected_images:
             inkex.errormsg("Please select one or more images.")
             return
 
+        images = []
         for image_id, image_element in self.svg.selected.items():
 #           inkex.utils.debug(image_element)
             if image_element is None or str(image_element) != 'image':
-                inkex.errormsg(f"Object with id '{image_id}' is not an image. Skipping.")
+                images.append((image_id, None, f"Object with id '{image_id}' is not an image. Skipping."))
                 continue
 
-            href = image_element.get('xlink:href')
-            if not href.startswith('data:image/'):
-                inkex.errormsg(f"Image with id '{image_id}' is not embedded. Skipping.")
+            href = image_element.get('xlink:href') or ''
+            if href.startswith('data:image/'):
+                images.append((image_id, image_element, href))
                 continue
 
-            metadata, base64_data = href.split(',', 1)
-            image_format = metadata.split(';')[0].split(':')[1]
+            path = self.linked_path(href)
+            if path is None:
+                images.append((image_id, None, f"Image with id '{image_id}' is not embedded. Skipping."))
+            elif not os.path.isfile(path):
+                images.append((image_id, None, f"Image with id '{image_id}' links to '{path}', which can not be read. Skipping."))
+            else:
+                images.append((image_id, image_element, path))
 
+        output = "sidecar" if sidecar_dir else "embed"
+        cache = ResultCache('white2alpha', compress=False)
+        keys = {}
+        results = {}  # key -> processed base64 or sidecar path, None or the error
+        jobs = {}
+        for image_id, image_element, source in images:
+            if image_element is None:
+                continue
             try:
-                image_bytes = base64.b64decode(base64_data)
-                img = Image.open(BytesIO(image_bytes)).convert("RGBA")
-                width, height = img.size
-                pixels = img.load()
-
-                if mode == 1:
-                        for x in range(width):
-                            for y in range(height):
-                                r, g, b, a = pixels[x, y]
-                                if all(v >= 255-threshold for v in (r,g,b)):
-                                    pixels[x, y] = (0, 0, 0, 255 - avg([r,g,b]))
-                elif mode == 2:
-                        for x in range(width):
-                            for y in range(height):
-                                r, g, b, a = pixels[x, y]
-                                if all(v >= 255-threshold for v in (r,g,b)):
-                                    pixels[x, y] = (255, 255, 255, 255 - avg([r,g,b]))
-                elif mode == 3:
-                        for x in range(width):
-                            for y in range(height):
-                                r, g, b, a = pixels[x, y]
-                                if all(v >= 255-threshold for v in (r,g,b)):
-                                    pixels[x, y] = (r, g, b, 255 - avg([r,g,b]))
-                elif mode == 4:
-                        for x in range(width):
-                            for y in range(height):
-                                r, g, b, a = pixels[x, y]
-                                if all(v >= 255-threshold for v in (r,g,b)):
-                                    pixels[x, y] = (r, g, b, 0)
-                                else :
-                                    pixels[x, y] = (0, 0, 0, 255)
-                elif mode == 5:
-                        for x in range(width):
-                            for y in range(height):
-                                r, g, b, a = pixels[x, y]
-                                if all(v >= 255-threshold for v in (r,g,b)):
-                                    pixels[x, y] = (r, g, b, 0)
-                                else :
-                                    pixels[x, y] = (255, 255, 255, 255)
-                elif mode == 6:
-                        for x in range(width):
-                            for y in range(height):
-                                r, g, b, a = pixels[x, y]
-                                if all(v >= 255-threshold for v in (r,g,b)):
-                                    pixels[x, y] = (0, 0, 0, 0)
-
-                output = BytesIO()
-                img.save(output,"png")
-                processed_data = output.getvalue()
-
-                processed_base64 = base64.b64encode(processed_data).decode('ascii')
-                new_href = f"data:{image_format};base64,{processed_base64}"
-                image_element.set('xlink:href', new_href)
-
-            except Exception as e:
-                inkex.errormsg(f"Error processing image with id '{image_id}': {e}")
+                if source.startswith('data:'):
+                    key = payload_key(source, threshold, mode, strip_height, output, image_format, level, palette)
+                else:
+                    key = file_key(source, threshold, mode, strip_height, output, image_format, level, palette)
+            except OSError as e:
+                keys[image_id] = image_id
+                results[image_id] = e
+                continue
+            keys[image_id] = key
+            if key in results or key in jobs:
+                continue  # a copy of an image seen before, processed once
+            data = cache.get(key)
+            if data is not None and (not data or output == "embed" or os.path.isfile(data.decode('utf-8'))):
+                results[key] = data.decode('utf-8') or None
+                continue
+            target = None
+            if sidecar_dir:
+                stem = os.path.splitext(os.path.basename(source))[0] if not source.startswith('data:') else "image"
+                target = os.path.join(sidecar_dir, f"{stem}-{key[:12]}.{image_format}")
+            jobs[key] = (source, target)
+        if workers > 1 and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                futures = [(key, pool.submit(process_image, source, threshold, mode, strip_height, target,
+                                             image_format, level, palette))
+                           for key, (source, target) in jobs.items()]
+                for key, future in futures:
+                    try:
+                        results[key] = future.result()
+                    except Exception as e:
+                        results[key] = e
+        else:
+            for key, (source, target) in jobs.items():
+                try:
+                    results[key] = process_image(source, threshold, mode, strip_height, target,
+                                                 image_format, level, palette)
+                except Exception as e:
+                    results[key] = e
+        for key in jobs:
+            # results the cache would evict at once, e.g. huge scans in strips, are not stored
+            if not isinstance(results[key], Exception) and len(results[key] or '') <= cache.max_bytes:
+                cache.put(key, (results[key] or '').encode('utf-8'))
+
+        done = []
+        for image_id, image_element, source in images:
+            if image_element is None:
+                inkex.errormsg(source)
+                continue
+
+            processed = results[keys[image_id]]
+            if isinstance(processed, Exception):
+                inkex.errormsg(f"Error processing image with id '{image_id}': {processed}")
+                continue
+            done.append((keys[image_id], image_element))
+            if processed is None:  # no pixel changes, keep the image as it is
+                continue
+
+            if sidecar_dir:
+                new_href = os.path.relpath(processed, sidecar_dir).replace(os.sep, '/')
+            else:
+                new_href = f"data:{MIME_TYPES[image_format]};base64,{processed}"
+            image_element.set('xlink:href', new_href)
+
+        if self.options.share:
+            self.share(done)
+
+    def linked_path(self, href):
+        """
+        Path of the local file a linked image points to, None for other links.
+        """
+        if href.startswith('file:'):
+            return url2pathname(urlparse(href).path)
+        if not href or re.match(r'[a-zA-Z][a-zA-Z0-9+.-]+:', href):
+            return None
+        return self.absolute_href(unquote(href))
+
+    def share(self, images):
+        """
+        Replace images with the same payload and size by clones of one image in defs.
+        """
+        copies = {}
+        for key, image_element in images:
+            size = tuple(image_element.get(name) for name in SHARED_ATTRIBUTES)
+            copies.setdefault((key, size), []).append(image_element)
+        for (key, size), elements in copies.items():
+            if len(elements) < 2:
+                continue
+            shared = inkex.Image()
+            for name in ('xlink:href',) + SHARED_ATTRIBUTES:
+                if elements[0].get(name) is not None:
+                    shared.set(name, elements[0].get(name))
+            self.svg.defs.add(shared)
+            shared_id = shared.get_id()
+            for image_element in elements:
+                clone = inkex.Use()
+                for name, value in image_element.attrib.items():
+                    if name not in SHARED_NAMES:
+                        clone.attrib[name] = value
+                clone.set('xlink:href', '#' + shared_id)
+                image_element.getparent().replace(image_element, clone)
 
 if __name__ == '__main__':
     KTX_White2Alpha().run()
-